@@ -1,6 +1,31 @@
+import multiprocessing
+import os
+import sqlite3
+import sys
+import logging
+
 from django.apps import AppConfig
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
 
 
 class ChartsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'charts'
+
+    def ready(self):
+        # Only processes serving requests follow the projects, not the trial
+        # workers, other management commands or the autoreloader's parent
+        if not settings.CATALOG_AUTOSTART or multiprocessing.parent_process() is not None:
+            return
+        if os.path.basename(sys.argv[0]) == 'manage.py':
+            if sys.argv[1:2] != ['runserver']:
+                return
+            if '--noreload' not in sys.argv and os.environ.get('RUN_MAIN') != 'true':
+                return
+        from .catalog import catalog
+        try:
+            catalog.start()
+        except (OSError, sqlite3.Error) as e:
+            logger.warning("Cannot start the catalog %s: %s", catalog.path, str(e))
@@ -0,0 +1,113 @@
+import json
+import os
+import logging
+
+from .catalog import SUBJECT_INFO_FILENAME
+
+logger = logging.getLogger(__name__)
+
+# Most directories a bulk request may create
+MAX_BULK_ITEMS = 5000
+
+
+def valid_name(value):
+    # Valid directory name, or None
+    if not isinstance(value, str) or not value or value.startswith('.') or '/' in value or os.sep in value:
+        return None
+    return value
+
+
+def _children(spec, key, errors, path):
+    children = spec.get(key, [])
+    if not isinstance(children, list):
+        errors.append({"path": "/".join(path), "error": "%s must be a list" % key})
+        return []
+    return children
+
+
+def flatten_spec(spec):
+    """
+    Validates a nested creation spec and flattens it into a list of
+    ``(path, info)`` items in creation order, ``info`` being the subject
+    attributes for subjects and None otherwise. Returns the items and a
+    list of errors, each with the path of the offending item.
+
+    The spec is ``{"subjects": [{"subject_id", "weight", "height",
+    "sessions": [{"session_name", "datafiles": [name or {"datafile_name"}]}]}]}``.
+    """
+    items, errors, seen = [], [], set()
+
+    def add(path, info=None):
+        if path in seen:
+            errors.append({"path": "/".join(path), "error": "Listed more than once"})
+        seen.add(path)
+        items.append((path, info))
+
+    for subject in _children(spec, "subjects", errors, ()):
+        subject = subject if isinstance(subject, dict) else {}
+        subject_id = valid_name(subject.get("subject_id"))
+        if not subject_id:
+            errors.append({"path": "", "error": "Invalid or missing subject_id: %r" % subject.get("subject_id")})
+            continue
+        if not subject.get("weight") or not subject.get("height"):
+            errors.append({"path": subject_id, "error": "Subject ID, weight, and height are required"})
+        add((subject_id,), {"subject_id": subject_id, "weight": subject.get("weight"), "height": subject.get("height")})
+
+        for session in _children(subject, "sessions", errors, (subject_id,)):
+            session = session if isinstance(session, dict) else {}
+            session_name = valid_name(session.get("session_name"))
+            if not session_name:
+                errors.append({"path": subject_id, "error": "Invalid or missing session_name: %r" % session.get("session_name")})
+                continue
+            add((subject_id, session_name))
+
+            for datafile in _children(session, "datafiles", errors, (subject_id, session_name)):
+                datafile_name = valid_name(datafile.get("datafile_name") if isinstance(datafile, dict) else datafile)
+                if not datafile_name:
+                    errors.append({"path": "%s/%s" % (subject_id, session_name), "error": "Invalid or missing datafile_name: %r" % datafile})
+                    continue
+                add((subject_id, session_name, datafile_name))
+
+    if len(items) > MAX_BULK_ITEMS:
+        errors.append({"path": "", "error": "At most %d items can be created at once" % MAX_BULK_ITEMS})
+    return items, errors
+
+
+def create_items(project_path, items):
+    """
+    Creates the flattened items below a project directory in one pass.
+
+    Existing directories are kept, and so is the info of existing subjects.
+    Returns a result per item, and the paths of the directories that
+    already existed and got new entries, relative to the project.
+    """
+    results = []
+    existing = {()} if os.path.isdir(project_path) else set()
+    touched = set()
+    failed = set()
+    for path, info in items:
+        name = "/".join(path)
+        if path[:-1] in failed:
+            failed.add(path)
+            results.append({"path": name, "status": "skipped", "error": "Parent could not be created"})
+            continue
+
+        full_path = os.path.join(project_path, *path)
+        if os.path.isdir(full_path):
+            existing.add(path)
+            results.append({"path": name, "status": "exists"})
+            continue
+        try:
+            os.makedirs(full_path)
+            if info is not None:
+                with open(os.path.join(full_path, SUBJECT_INFO_FILENAME), 'w') as json_file:
+                    json.dump(info, json_file)
+        except OSError as e:
+            logger.error("Error creating %s: %s", full_path, str(e))
+            failed.add(path)
+            results.append({"path": name, "status": "error", "error": str(e)})
+            continue
+        if path[:-1] in existing:
+            touched.add(path[:-1])
+        results.append({"path": name, "status": "created"})
+    return results, touched
@@ -0,0 +1,393 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import logging
+from contextlib import closing
+
+from django.conf import settings
+
+from .storage import StorageFormatError, describe_storage, is_storage_file, summarize_storage
+from .tree import LEVELS, project_index
+
+logger = logging.getLogger(__name__)
+
+# Key columns of the hierarchy, one per level
+KEYS = ('project', 'subject', 'session', 'datafile')
+
+# File written by create_subject with the subject's attributes
+SUBJECT_INFO_FILENAME = 'subject_info.json'
+
+# Seconds a trial must stay unchanged before it is described, so a file that
+# is still being written is parsed once it is complete rather than on every change
+TRIAL_SETTLE_SECONDS = 2.0
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS projects (
+    project TEXT NOT NULL,
+    PRIMARY KEY (project)
+);
+CREATE TABLE IF NOT EXISTS subjects (
+    project TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    weight REAL,
+    height REAL,
+    info TEXT,
+    info_mtime REAL,
+    PRIMARY KEY (project, subject)
+);
+CREATE INDEX IF NOT EXISTS subjects_weight ON subjects (weight);
+CREATE INDEX IF NOT EXISTS subjects_height ON subjects (height);
+CREATE TABLE IF NOT EXISTS sessions (
+    project TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    session TEXT NOT NULL,
+    PRIMARY KEY (project, subject, session)
+);
+CREATE TABLE IF NOT EXISTS datafiles (
+    project TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    session TEXT NOT NULL,
+    datafile TEXT NOT NULL,
+    PRIMARY KEY (project, subject, session, datafile)
+);
+CREATE TABLE IF NOT EXISTS trials (
+    project TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    session TEXT NOT NULL,
+    datafile TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER,
+    mtime REAL,
+    rows INTEGER,
+    duration REAL,
+    in_degrees INTEGER,
+    columns TEXT,
+    stats TEXT,
+    PRIMARY KEY (project, subject, session, datafile, name)
+);
+CREATE INDEX IF NOT EXISTS trials_duration ON trials (duration);
+CREATE TABLE IF NOT EXISTS trial_columns (
+    project TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    session TEXT NOT NULL,
+    datafile TEXT NOT NULL,
+    name TEXT NOT NULL,
+    column_name TEXT NOT NULL,
+    PRIMARY KEY (project, subject, session, datafile, name, column_name)
+);
+CREATE INDEX IF NOT EXISTS trial_columns_name ON trial_columns (column_name);
+'''
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _trial(row):
+    # Decode the JSON and boolean fields of a trials row
+    trial = dict(row, in_degrees=None if row["in_degrees"] is None else bool(row["in_degrees"]))
+    for field, default in (("columns", '[]'), ("stats", '{}')):
+        if field in trial:
+            trial[field] = json.loads(trial[field] or default)
+    return trial
+
+
+def _where(rel):
+    # Condition matching the rows below a directory of the hierarchy, or of one trial
+    return ' AND '.join('%s = ?' % key for key in (KEYS + ('name',))[:len(rel)]) or '1'
+
+
+class Catalog:
+    """
+    SQLite catalog of the project hierarchy, the subjects' attributes and
+    the metadata and summary statistics of every trial, for filtered
+    listings without walking the disk or downloading trials.
+
+    The catalog mirrors the project index. A worker thread brings it up to
+    date from the index's listings on start, then applies the changes the
+    index queues for it, so neither the index nor the requests wait on the
+    catalog, and queries answer from what is synchronized so far. New and
+    changed trials are described, which parses them in full, by the same
+    worker once they have settled for TRIAL_SETTLE_SECONDS. Trials are only
+    described again when a file's size or modification time changes, so
+    restarts are cheap.
+    """
+
+    def __init__(self, path, index):
+        self.path = path
+        self.index = index
+        self.lock = threading.Lock()
+        self.started = False
+        self.changes = queue.Queue()
+        # Trials waiting to be described, as path: (size, mtime, due time),
+        # only touched by the worker
+        self.unsettled = {}
+        self.synced = threading.Event()
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def start(self):
+        """
+        Creates the catalog and starts bringing it up to date with the
+        index in the background, when the server starts or on first use.
+        """
+        with self.lock:
+            if self.started:
+                return
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with closing(self.connect()) as connection:
+                connection.execute('PRAGMA journal_mode=WAL')
+                connection.executescript(SCHEMA)
+                # Catalogs created before the trial statistics lack their column
+                if 'stats' not in {row["name"] for row in connection.execute('PRAGMA table_info(trials)')}:
+                    connection.execute('ALTER TABLE trials ADD COLUMN stats TEXT')
+            self.started = True
+        threading.Thread(target=self.run, name='catalog', daemon=True).start()
+
+    def run(self):
+        self.synchronize()
+        while True:
+            # Changes come first, a trial is described once nothing is queued
+            due = min((entry[2] for entry in self.unsettled.values()), default=None)
+            try:
+                changes = self.changes.get(timeout=None if due is None else max(0, due - time.monotonic()))
+            except queue.Empty:
+                self._describe_next()
+                continue
+            try:
+                self._apply(changes)
+            except Exception as e:
+                logger.error("Failed to apply changes to catalog %s: %s", self.path, str(e))
+
+    def synchronize(self):
+        self.index.start()
+        # Register under the index lock so no change is missed between the
+        # snapshot and the first notification. Changes wait in the queue
+        # until the snapshot is applied.
+        with self.index.lock:
+            entries = {rel: dict(entry) for rel, entry in self.index.entries.items()}
+            self.index.listeners.append(self.apply)
+
+        try:
+            with closing(self.connect()) as connection, connection:
+                self._delete_missing(connection, entries)
+                for rel in sorted(entries, key=len):
+                    self._sync(connection, rel, entries[rel]["dirs"], entries[rel]["files"])
+        except Exception as e:
+            logger.error("Failed to synchronize catalog %s: %s", self.path, str(e))
+        self.synced.set()
+        logger.info("Catalog %s synchronized with %s, %d trials to describe",
+                    self.path, self.index.root, len(self.unsettled))
+
+    def apply(self, changes):
+        """
+        Queues changes of the project index for the catalog's worker.
+        """
+        self.changes.put(changes)
+
+    def _apply(self, changes):
+        with closing(self.connect()) as connection, connection:
+            for change in changes:
+                rel = tuple(change["path"])
+                if change["change"] == "removed":
+                    self._delete(connection, rel)
+                else:
+                    self._sync(connection, rel, set(change["dirs"]), change["files"])
+
+    def _delete_missing(self, connection, entries):
+        # Drop the directories that disappeared while the server was down
+        for level, table in enumerate(LEVELS):
+            keys = KEYS[:level + 1]
+            for row in connection.execute('SELECT %s FROM %s' % (', '.join(keys), table)).fetchall():
+                if tuple(row) not in entries and tuple(row)[:-1] in entries:
+                    self._delete(connection, tuple(row))
+
+    def _delete(self, connection, rel):
+        for table in LEVELS[max(len(rel) - 1, 0):] + ('trials', 'trial_columns'):
+            connection.execute('DELETE FROM %s WHERE %s' % (table, _where(rel)), rel)
+        for key in [key for key in self.unsettled if key[:len(rel)] == rel]:
+            del self.unsettled[key]
+
+    def _sync(self, connection, rel, dirs, files):
+        # Mirror one directory listing of the index
+        level = len(rel)
+        if level < len(LEVELS):
+            table, key = LEVELS[level], KEYS[level]
+            known = {row[0] for row in connection.execute(
+                'SELECT %s FROM %s WHERE %s' % (key, table, _where(rel)), rel)}
+            for name in known - dirs:
+                self._delete(connection, rel + (name,))
+            connection.executemany(
+                'INSERT OR IGNORE INTO %s (%s) VALUES (%s)' % (table, ', '.join(KEYS[:level + 1]), ', '.join('?' * (level + 1))),
+                [rel + (name,) for name in dirs - known]
+            )
+        if level == 2:
+            self._sync_subject(connection, rel, files.get(SUBJECT_INFO_FILENAME))
+        elif level == len(LEVELS):
+            self._sync_trials(connection, rel, files)
+
+    def _sync_subject(self, connection, rel, stat):
+        row = connection.execute('SELECT info_mtime FROM subjects WHERE %s' % _where(rel), rel).fetchone()
+        mtime = stat["mtime"] if stat else None
+        if row is None or row["info_mtime"] == mtime:
+            return
+        info = {}
+        if stat:
+            try:
+                with open(os.path.join(self.index.root, *rel, SUBJECT_INFO_FILENAME)) as info_file:
+                    info = json.load(info_file)
+            except (OSError, ValueError) as e:
+                logger.warning("Cannot read the subject info of %s: %s", '/'.join(rel), str(e))
+        connection.execute(
+            'UPDATE subjects SET weight = ?, height = ?, info = ?, info_mtime = ? WHERE %s' % _where(rel),
+            (_float(info.get("weight")), _float(info.get("height")), json.dumps(info), mtime) + rel
+        )
+
+    def _sync_trials(self, connection, rel, files):
+        # Trials cataloged before their statistics existed are described again
+        known = {row["name"]: (row["size"], row["mtime"], row["stats"] is not None) for row in connection.execute(
+            'SELECT name, size, mtime, stats FROM trials WHERE %s' % _where(rel), rel)}
+        trials = {name: stat for name, stat in files.items() if is_storage_file(name)}
+
+        for name in set(known) - set(trials):
+            self._delete(connection, rel + (name,))
+        for key in [key for key in self.unsettled if key[:-1] == rel and key[-1] not in trials]:
+            del self.unsettled[key]
+        for name, stat in trials.items():
+            key = rel + (name,)
+            if known.get(name) == (stat["size"], stat["mtime"], True):
+                continue
+            # Every change of a file still being written postpones it
+            pending = self.unsettled.get(key)
+            if pending is None or pending[:2] != (stat["size"], stat["mtime"]):
+                self.unsettled[key] = (stat["size"], stat["mtime"], time.monotonic() + TRIAL_SETTLE_SECONDS)
+
+    def _describe_next(self):
+        # Describe the trial that settled first, if it is still as listed
+        key = min(self.unsettled, key=lambda key: self.unsettled[key][2])
+        size, mtime, _ = self.unsettled.pop(key)
+        file_path = os.path.join(self.index.root, *key)
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return
+        if (stat.st_size, stat.st_mtime) != (size, mtime):
+            # Changed since it was listed, the index will report it again
+            self.unsettled[key] = (stat.st_size, stat.st_mtime, time.monotonic() + TRIAL_SETTLE_SECONDS)
+            return
+
+        try:
+            meta = describe_storage(file_path)
+        except (OSError, StorageFormatError) as e:
+            logger.warning("Cannot describe trial %s: %s", '/'.join(key), str(e))
+            meta = {"columns": [], "rows": None, "duration": None, "in_degrees": None}
+        try:
+            stats = summarize_storage(file_path)
+        except (OSError, StorageFormatError) as e:
+            logger.warning("Cannot compute the statistics of trial %s: %s", '/'.join(key), str(e))
+            stats = {}
+
+        with closing(self.connect()) as connection, connection:
+            # The datafile may have been removed while the trial was parsed
+            if connection.execute('SELECT 1 FROM datafiles WHERE %s' % _where(key[:-1]), key[:-1]).fetchone() is None:
+                return
+            connection.execute(
+                'INSERT OR REPLACE INTO trials VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                key + (size, mtime, meta["rows"], meta["duration"],
+                       meta["in_degrees"], json.dumps(meta["columns"]), json.dumps(stats))
+            )
+            connection.execute('DELETE FROM trial_columns WHERE %s' % _where(key), key)
+            connection.executemany(
+                'INSERT OR IGNORE INTO trial_columns VALUES (?, ?, ?, ?, ?, ?)',
+                [key + (column,) for column in meta["columns"]]
+            )
+
+    def query_trials(self, project=None, subject=None, session=None, min_weight=None, max_weight=None,
+                     min_height=None, max_height=None, min_duration=None, max_duration=None, columns=()):
+        """
+        Lists the trials matching the given filters, with their summary
+        statistics and their subject's attributes. Every filter left as None is ignored, and a trial must
+        hold all of ``columns``.
+        """
+        self.start()
+        conditions, params = [], []
+        for field, value in (('t.project', project), ('t.subject', subject), ('t.session', session)):
+            if value is not None:
+                conditions.append('%s = ?' % field)
+                params.append(value)
+        for field, op, value in (('s.weight', '>=', min_weight), ('s.weight', '<=', max_weight),
+                                 ('s.height', '>=', min_height), ('s.height', '<=', max_height),
+                                 ('t.duration', '>=', min_duration), ('t.duration', '<=', max_duration)):
+            if value is not None:
+                conditions.append('%s %s ?' % (field, op))
+                params.append(value)
+        for column in columns:
+            conditions.append(
+                'EXISTS (SELECT 1 FROM trial_columns c WHERE c.project = t.project AND c.subject = t.subject'
+                ' AND c.session = t.session AND c.datafile = t.datafile AND c.name = t.name AND c.column_name = ?)'
+            )
+            params.append(column)
+
+        with closing(self.connect()) as connection:
+            rows = connection.execute(
+                'SELECT t.project, t.subject, t.session, t.datafile, t.name, t.rows, t.duration, t.in_degrees,'
+                ' t.columns, t.stats, s.weight, s.height FROM trials t'
+                ' LEFT JOIN subjects s ON s.project = t.project AND s.subject = t.subject'
+                ' WHERE %s ORDER BY t.project, t.subject, t.session, t.datafile, t.name'
+                % (' AND '.join(conditions) or '1'), params
+            ).fetchall()
+        return [_trial(row) for row in rows]
+
+    def trial_stats(self, rel):
+        """
+        Returns the row count, duration, angle units and summary statistics
+        of the trials below a directory of the hierarchy, keyed by the
+        trials' paths.
+        """
+        self.start()
+        with closing(self.connect()) as connection:
+            rows = connection.execute(
+                'SELECT project, subject, session, datafile, name, rows, duration, in_degrees, stats'
+                ' FROM trials WHERE %s' % _where(rel), tuple(rel)
+            ).fetchall()
+        trials = {}
+        for row in rows:
+            trial = _trial(row)
+            trials[tuple(trial.pop(key) for key in KEYS + ('name',))] = trial
+        return trials
+
+    def query_subjects(self, project=None, min_weight=None, max_weight=None, min_height=None, max_height=None):
+        """
+        Lists the subjects matching the given filters with their attributes
+        and trial counts. Every filter left as None is ignored.
+        """
+        self.start()
+        conditions, params = [], []
+        for field, op, value in (('s.project', '=', project),
+                                 ('s.weight', '>=', min_weight), ('s.weight', '<=', max_weight),
+                                 ('s.height', '>=', min_height), ('s.height', '<=', max_height)):
+            if value is not None:
+                conditions.append('%s %s ?' % (field, op))
+                params.append(value)
+
+        with closing(self.connect()) as connection:
+            rows = connection.execute(
+                'SELECT s.project, s.subject, s.weight, s.height, s.info,'
+                ' (SELECT COUNT(*) FROM trials t WHERE t.project = s.project AND t.subject = s.subject) AS trials'
+                ' FROM subjects s WHERE %s ORDER BY s.project, s.subject'
+                % (' AND '.join(conditions) or '1'), params
+            ).fetchall()
+        return [dict(row, info=json.loads(row["info"] or '{}')) for row in rows]
+
+
+# Catalog of the projects directory shared by the views of this process
+catalog = Catalog(settings.CATALOG_PATH, project_index)
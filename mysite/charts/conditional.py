@@ -0,0 +1,32 @@
+import hashlib
+import os
+from datetime import datetime, timezone
+
+
+def path_etag(path, variant=''):
+    """
+    ETag of a file or directory, from its modification time and size plus
+    a hash of ``variant`` for different representations of the same path.
+    Returns None if the path does not exist.
+
+    A directory's modification time changes whenever an entry is added,
+    removed or renamed, which is all a listing depends on.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    etag = '%x-%x' % (stat.st_mtime_ns, stat.st_size)
+    if variant:
+        etag += '-' + hashlib.sha1(variant.encode()).hexdigest()[:16]
+    return etag
+
+
+def path_last_modified(path):
+    """
+    Modification time of a file or directory, None if it does not exist.
+    """
+    try:
+        return datetime.fromtimestamp(os.stat(path).st_mtime, tz=timezone.utc)
+    except OSError:
+        return None
@@ -1,94 +1,396 @@
 import json
 import asyncio
-import websockets
 import logging
 from datetime import datetime, timezone
+from urllib.parse import parse_qs
 
+import numpy as np
+from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 from django.conf import settings
 
+from . import upstream
+from .decimation import Decimator, LATEST, MODES
+from .outbox import Outbox
+from .protocol import BINARY_SUBPROTOCOL, pack_frames, schema_message
+from .tree import TREE_GROUP, project_index
+
 logger = logging.getLogger(__name__)
 
-class BridgeConsumer(AsyncWebsocketConsumer):
+# consumer sending its frames through an outbox. Clients connecting with ?ack=1
+# send {"op": "ack", "received": n} with the number of messages, of any kind,
+# they have received so far, so the outbox knows how far behind they are.
+class OutboxConsumer(AsyncWebsocketConsumer):
+    outbox = None
+
+    def open_outbox(self, send_frame):
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        self.outbox = Outbox(
+            send_frame,
+            settings.WS_SEND_QUEUE_SIZE,
+            settings.WS_SEND_QUEUE_POLICY,
+            settings.WS_SEND_QUEUE_MAX_LAG,
+            acks=query.get('ack', [''])[0] in ('1', 'true'),
+        )
+        self.outbox.start()
+
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        if self.outbox and (text_data is not None or bytes_data is not None):
+            self.outbox.wrote()
+        await super().send(text_data, bytes_data, close)
+
+    def receive_ack(self, request):
+        if not self.outbox.acks:
+            raise ValueError("Acknowledgements need a connection opened with ?ack=1")
+        self.outbox.ack(request.get('received'))
+
+class BridgeConsumer(OutboxConsumer):
+    topic = "/ik/output"
+
     async def connect(self):
-        logger.info("connecting to rosbridge")
-        self.ros_bridge = await websockets.connect(settings.ROSBRIDGE_WS_URL)
-        await self.ros_bridge.send(json.dumps({
-            "op": "subscribe",
-            "topic": "/ik/output"
-        }))
-        await self.accept()
-        asyncio.create_task(self.forward_data())
+        self.subscription = None
+        self.flush_task = None
+
+        # Clients offering the binary subprotocol get packed float32 frames
+        # after a JSON schema instead of one JSON envelope per frame
+        self.binary = BINARY_SUBPROTOCOL in self.scope.get('subprotocols', [])
+        self.schema = None
+        self.backfill_seq = 0
+
+        # Clients may cap their update rate with ?rate=<Hz>&mode=<latest|mean|minmax>,
+        # the frames received in between are coalesced into one
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        self.decimator = None
+        if 'rate' in query:
+            try:
+                self.rate = rate = float(query['rate'][0])
+                if rate <= 0:
+                    raise ValueError("rate must be positive")
+                self.decimator = Decimator(query.get('mode', [LATEST])[0])
+            except ValueError as e:
+                logger.error("Rejecting bridge connection: %s", str(e))
+                await self.close()
+                return
+            self.latest = None
+            self.flush_task = asyncio.create_task(self.flush_frames(1 / rate))
+
+        # Frames are sent from a bounded queue so a slow client cannot stall
+        # the consumer, and one that acknowledges cannot grow its buffers
+        self.open_outbox(self.send_frame)
+
+        logger.info("joining shared subscription to %s", self.topic)
+        self.subscription = upstream.acquire(self.topic)
+        await self.channel_layer.group_add(self.subscription.group, self.channel_name)
+        await self.accept(subprotocol=BINARY_SUBPROTOCOL if self.binary else None)
+        await self.send_backfill()
 
     async def disconnect(self, close_code):
-        await self.ros_bridge.close()
-
-    def rad_to_deg(self, rad):
-        return rad * (180 / 3.14159265)
-    
-    #  convert radians to degrees
-    def convert_data(self, data):
-        return [
-            self.rad_to_deg(val) if idx not in [3, 4, 5] else val
-            for idx, val in enumerate(data)
-        ]
-    
+        if self.flush_task:
+            self.flush_task.cancel()
+        if self.subscription:
+            self.outbox.stop()
+            await self.channel_layer.group_discard(self.subscription.group, self.channel_name)
+            upstream.release(self.subscription)
+
+    # the only messages bridge clients send are acknowledgements
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            request = json.loads(text_data or '')
+            if request.get('op') != 'ack':
+                raise ValueError("Unknown op '%s'" % request.get('op'))
+            self.receive_ack(request)
+        except (ValueError, TypeError, AttributeError) as e:
+            await self.send(text_data=json.dumps({"op": "error", "message": str(e)}))
+
     def convert_timestamp(self, timestamp):
         dt = datetime.fromtimestamp(timestamp, tz=timezone.utc)
         return dt.strftime('%H:%M:%S')
 
-    async def forward_data(self):
-        logger.debug("forwarding data")
+    # forward a frame fanned out by the shared subscription, its data has
+    # already been converted to degrees by the subscription
+    async def ros_message(self, event):
+        # Skip frames that were already part of the backfill
+        if event['seq'] <= self.backfill_seq:
+            return
+        data = event['data']
+        if self.decimator:
+            msg = data.get('msg', {})
+            if 'data' in msg:
+                self.decimator.add(msg.get('time'), msg['data'])
+                self.latest = data
+            return
+        await self.queue_frame(data)
+
+    async def queue_frame(self, data):
+        if self.outbox.stopped:
+            return
+        if not self.outbox.put(data):
+            logger.warning("Disconnecting bridge client %s, it fell too far behind", self.channel_name)
+            self.outbox.stop()
+            await self.close()
+
+    # send the recent history kept by the shared subscription, so the client
+    # has something to draw before the next frame arrives
+    async def send_backfill(self):
+        times, values, self.backfill_seq = self.subscription.backfill()
+        if not len(times):
+            return
+        # Thin the history to the client's rate, keeping the newest frame
+        if self.decimator and len(times) > 1 and times[-1] > times[0]:
+            observed_rate = (len(times) - 1) / (times[-1] - times[0])
+            stride = max(1, int(observed_rate / self.rate))
+            times = times[::-1][::stride][::-1]
+            values = values[::-1][::stride][::-1]
+
+        if self.binary:
+            await self.send_schema(values.shape[1])
+            await self.send(bytes_data=pack_frames(times, values))
+            return
+
+        await self.send(text_data=json.dumps({
+            "op": "backfill",
+            "topic": self.topic,
+            "msg": {
+                "data": values.tolist(),
+                "time": [None if np.isnan(t) else self.convert_timestamp(t) for t in times]
+            }
+        }))
+
+    # send the coalesced frame of every interval to rate-limited clients
+    async def flush_frames(self, interval):
         while True:
-            message = await self.ros_bridge.recv()
-            logger.debug(f"Received message from ROS: {message}")
-            data = json.loads(message)
-            if 'msg' in data:
-                if 'data' in data['msg']:
-                    # Convert the data
-                    converted_data = self.convert_data(data['msg']['data'])
-                    data['msg']['data'] = converted_data
-                if 'time' in data['msg']:
-                    # Convert the timestamp
-                    converted_time = self.convert_timestamp(data['msg']['time'])
-                    data['msg']['time'] = converted_time
-
-            await self.send(text_data=json.dumps(data))
+            await asyncio.sleep(interval)
+            frame = self.decimator.flush()
+            if frame is None:
+                continue
+            msg = dict(self.latest['msg'])
+            for key, values in frame.items():
+                msg[key] = values.tolist() if key != 'time' else values
+            await self.queue_frame(dict(self.latest, msg=msg))
+
+    async def send_frame(self, data):
+        if self.binary:
+            await self.send_binary_frame(data.get('msg', {}))
+            return
+
+        if 'msg' in data:
+            if data['msg'].get('time') is not None:
+                # Convert the timestamp
+                converted_time = self.convert_timestamp(data['msg']['time'])
+                data['msg']['time'] = converted_time
+
+        await self.send(text_data=json.dumps(data))
+
+    # (re)send the schema before the first binary frame and whenever the
+    # frame layout changes, minmax frames carry the envelope of each coordinate
+    async def send_schema(self, width, envelope=False):
+        if (width, envelope) == self.schema:
+            return
+        self.schema = (width, envelope)
+        columns = self.subscription.columns(width)
+        if envelope:
+            columns = [c + '_min' for c in columns] + [c + '_max' for c in columns]
+        await self.send(text_data=json.dumps(schema_message(self.topic, columns)))
+
+    async def send_binary_frame(self, msg):
+        if 'data' not in msg:
+            return
+        values = msg['data']
+        await self.send_schema(len(values), 'min' in msg)
+        if 'min' in msg:
+            values = msg['min'] + msg['max']
+        time = msg.get('time')
+        await self.send(bytes_data=pack_frames(float('nan') if time is None else time, values))
 
 # class for subscribing to ROS logs
 class LogConsumer(AsyncWebsocketConsumer):
+    topic = "/flexbe/log"
+    url = "ws://172.18.0.5:9090/"
+
     async def connect(self):
         # Accept the WebSocket connection
         await self.accept()
 
-        # Subscribe to the ROS /flexbe/log topic using rosbridge
-        self.rosbridge_ws = await websockets.connect("ws://172.18.0.5:9090/")
-        await self.rosbridge_ws.send(json.dumps({
-            "op": "subscribe",
-            "topic": "/flexbe/log"
+        # Join the shared rosbridge subscription to the /flexbe/log topic
+        self.subscription = upstream.acquire(self.topic, self.url)
+        await self.channel_layer.group_add(self.subscription.group, self.channel_name)
+
+    async def ros_message(self, event):
+        log_data = event['data']
+        logger.info("Logs:%s", log_data)
+        # Send the log message to the WebSocket client
+        await self.send(text_data=json.dumps({
+            'log': log_data
         }))
 
-        # Start receiving logs
-        self.receive_task = asyncio.create_task(self.receive_ros_logs())
+    async def disconnect(self, close_code):
+        # Leave the shared rosbridge subscription
+        await self.channel_layer.group_discard(self.subscription.group, self.channel_name)
+        upstream.release(self.subscription)
+
+# state of one topic a gateway client subscribed to
+class TopicStream:
+    def __init__(self, subscription, fields=None, rate=None, mode=LATEST):
+        self.subscription = subscription
+        self.fields = fields
+        self.rate = rate
+        self.decimator = Decimator(mode) if rate else None
+        self.latest = None
+        self.flush_task = None
+
+    def project(self, msg):
+        if self.fields is None:
+            return msg
+        return {key: msg[key] for key in self.fields if key in msg}
+
+    # keep a frame until the next flush, numeric data is coalesced by the
+    # decimator, any other message is sent latest-wins
+    def add(self, data):
+        self.latest = data
+        msg = data.get('msg', {})
+        if 'data' in msg:
+            try:
+                self.decimator.add(msg.get('time'), msg['data'])
+            except (TypeError, ValueError):
+                pass
+
+    def flush(self):
+        if self.latest is None:
+            return None
+        msg = dict(self.latest.get('msg', {}))
+        frame = self.decimator.flush()
+        if frame is not None:
+            for key, values in frame.items():
+                msg[key] = values.tolist() if key != 'time' else values
+        self.latest = None
+        return msg
+
+
+# gateway multiplexing any number of ROS topics over one websocket, clients send
+# {"op": "subscribe", "topic": ..., "rate": ..., "mode": ..., "fields": [...]}
+# and {"op": "unsubscribe", "topic": ...}, plus acknowledgements when opened with ?ack=1
+class TopicGatewayConsumer(OutboxConsumer):
+    async def connect(self):
+        self.streams = {}
+        self.open_outbox(self.send_frame)
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        self.outbox.stop()
+        # One failing stream must not keep the others subscribed upstream
+        for topic in list(self.streams):
+            try:
+                await self.unsubscribe(topic)
+            except Exception as e:
+                logger.error("Failed to unsubscribe %s from %s: %s", self.channel_name, topic, str(e))
+
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            request = json.loads(text_data or '')
+            op = request.get('op')
+            if op == 'ack':
+                self.receive_ack(request)
+                return
+            topic = request.get('topic')
+            if not isinstance(topic, str) or not topic.startswith('/'):
+                raise ValueError("A topic starting with '/' is required")
+            if op == 'subscribe':
+                await self.subscribe(topic, request)
+                reply = "subscribed"
+            elif op == 'unsubscribe':
+                await self.unsubscribe(topic)
+                reply = "unsubscribed"
+            else:
+                raise ValueError("Unknown op '%s'" % op)
+        except (ValueError, TypeError, AttributeError) as e:
+            await self.send(text_data=json.dumps({"op": "error", "message": str(e)}))
+            return
+        await self.send(text_data=json.dumps({"op": reply, "topic": topic}))
+
+    async def subscribe(self, topic, request):
+        rate = request.get('rate')
+        fields = request.get('fields')
+        if rate is not None and (not isinstance(rate, (int, float)) or rate <= 0):
+            raise ValueError("rate must be a positive number")
+        if fields is not None and not isinstance(fields, list):
+            raise ValueError("fields must be a list")
+        mode = request.get('mode', LATEST)
+        if mode not in MODES:
+            raise ValueError("Unknown reduction mode '%s'" % mode)
+        if topic not in self.streams and len(self.streams) >= settings.WS_MAX_STREAMS:
+            raise ValueError("At most %d topics can be subscribed at once" % settings.WS_MAX_STREAMS)
+        try:
+            self.channel_layer.valid_group_name(upstream.group_name(topic))
+        except TypeError:
+            raise ValueError("Invalid topic name '%s'" % topic)
+
+        # Re-subscribing replaces the rate and fields of a topic
+        if topic in self.streams:
+            await self.unsubscribe(topic)
+        stream = TopicStream(None, fields, rate, mode)
+        stream.subscription = upstream.acquire(topic)
+        try:
+            await self.channel_layer.group_add(stream.subscription.group, self.channel_name)
+        except Exception:
+            upstream.release(stream.subscription)
+            raise
+        self.streams[topic] = stream
+        if rate:
+            stream.flush_task = asyncio.create_task(self.flush_frames(topic, stream, 1 / rate))
 
-    async def receive_ros_logs(self):
+    async def unsubscribe(self, topic):
+        stream = self.streams.pop(topic, None)
+        if stream is None:
+            return
+        if stream.flush_task:
+            stream.flush_task.cancel()
         try:
-            while True:
-                # Receive log messages from ROS through rosbridge
-                log_message = await self.rosbridge_ws.recv()
-                log_data = json.loads(log_message)
-                logger.info("Logs:%s", log_data)
-                # Send the log message to the WebSocket client
-                await self.send(text_data=json.dumps({
-                    'log': log_data
-                }))
-        except websockets.ConnectionClosed:
-            # Handle WebSocket disconnection
+            await self.channel_layer.group_discard(stream.subscription.group, self.channel_name)
+        finally:
+            upstream.release(stream.subscription)
+
+    async def ros_message(self, event):
+        stream = self.streams.get(event['topic'])
+        if stream is None:
+            return
+        if stream.decimator:
+            stream.add(event['data'])
+            return
+        await self.queue_frame(event['topic'], stream, event['data'].get('msg', {}))
+
+    async def queue_frame(self, topic, stream, msg):
+        if self.outbox.stopped:
+            return
+        if not self.outbox.put((topic, stream.project(msg))):
+            logger.warning("Disconnecting gateway client %s, it fell too far behind", self.channel_name)
+            self.outbox.stop()
             await self.close()
 
-    async def disconnect(self, close_code):
-        # Close the WebSocket and the rosbridge connection
-        if self.rosbridge_ws:
-            await self.rosbridge_ws.close()
-        await self.close()
+    async def flush_frames(self, topic, stream, interval):
+        while True:
+            await asyncio.sleep(interval)
+            msg = stream.flush()
+            if msg is not None:
+                await self.queue_frame(topic, stream, msg)
 
+    async def send_frame(self, frame):
+        topic, msg = frame
+        await self.send(text_data=json.dumps({"op": "publish", "topic": topic, "msg": msg}))
+
+# class for pushing changes of the project tree to clients
+class TreeConsumer(AsyncWebsocketConsumer):
+    async def connect(self):
+        await self.accept()
+
+        # Join before taking the snapshot so no change falls in between
+        project_index.loop = asyncio.get_running_loop()
+        await self.channel_layer.group_add(TREE_GROUP, self.channel_name)
+        tree = await sync_to_async(project_index.tree)()
+        await self.send(text_data=json.dumps({"op": "snapshot", "projects": tree}))
+
+    async def tree_change(self, event):
+        # Each change replaces the listing of a directory or removes it
+        await self.send(text_data=json.dumps({"op": "changes", "changes": event["changes"]}))
+
+    async def disconnect(self, close_code):
+        await self.channel_layer.group_discard(TREE_GROUP, self.channel_name)
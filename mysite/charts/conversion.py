@@ -0,0 +1,55 @@
+import numpy as np
+
+# Kinds of OpenSim model coordinates
+ROTATIONAL = 'rotational'
+TRANSLATIONAL = 'translational'
+
+RAD_TO_DEG = 180 / np.pi
+
+
+class UnitConverter:
+    """
+    Converts IK coordinates from radians to degrees in one vectorized multiply.
+
+    The coordinate map lists ``(name, kind)`` pairs in the order of the frame
+    values. Rotational coordinates are scaled to degrees and translational ones
+    are passed through. Values past the end of the map are treated as rotational.
+    """
+
+    def __init__(self, coordinate_map):
+        self.names = []
+        self.kinds = []
+        for name, kind in coordinate_map:
+            if kind not in (ROTATIONAL, TRANSLATIONAL):
+                raise ValueError("Unknown kind '%s' for coordinate '%s'" % (kind, name))
+            self.names.append(name)
+            self.kinds.append(kind)
+        self.scale = None
+
+    def column_names(self, width):
+        """
+        Returns the coordinate names of frames of the given width, numbering
+        the values past the end of the map.
+        """
+        return self.names[:width] + ['coordinate_%d' % idx for idx in range(len(self.names), width)]
+
+    def scale_vector(self, width):
+        """
+        Returns the per-coordinate scale for frames of the given width.
+
+        The vector is built once and only rebuilt if the frame width changes.
+        """
+        if self.scale is None or len(self.scale) != width:
+            scale = np.full(width, RAD_TO_DEG)
+            for idx, kind in enumerate(self.kinds[:width]):
+                if kind == TRANSLATIONAL:
+                    scale[idx] = 1.0
+            self.scale = scale
+        return self.scale
+
+    def __call__(self, frames):
+        """
+        Converts a single frame of shape (n,) or a batch of frames of shape (m, n).
+        """
+        frames = np.asarray(frames, dtype=np.float64)
+        return frames * self.scale_vector(frames.shape[-1])
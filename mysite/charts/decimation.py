@@ -0,0 +1,64 @@
+import numpy as np
+
+# Reduction modes for frames coalesced between two flushes
+LATEST = 'latest'
+MEAN = 'mean'
+MINMAX = 'minmax'
+
+MODES = (LATEST, MEAN, MINMAX)
+
+
+class Decimator:
+    """
+    Coalesces the frames received between two flushes into a single frame.
+
+    ``latest`` keeps the most recent frame, ``mean`` averages the frames and
+    ``minmax`` keeps the per-coordinate envelope next to the most recent frame.
+    """
+
+    def __init__(self, mode=LATEST):
+        if mode not in MODES:
+            raise ValueError("Unknown reduction mode '%s'" % mode)
+        self.mode = mode
+        self.count = 0
+        self.time = None
+        self.latest = None
+        self.total = None
+        self.min = None
+        self.max = None
+
+    def add(self, time, values):
+        values = np.asarray(values, dtype=np.float64)
+        # Start over on the first frame of an interval or if the width changes
+        if self.count == 0 or values.shape != self.latest.shape:
+            self.count = 0
+            if self.mode == MEAN:
+                self.total = values.copy()
+            elif self.mode == MINMAX:
+                self.min = values.copy()
+                self.max = values.copy()
+        elif self.mode == MEAN:
+            self.total += values
+        elif self.mode == MINMAX:
+            np.minimum(self.min, values, out=self.min)
+            np.maximum(self.max, values, out=self.max)
+        self.count += 1
+        self.time = time
+        self.latest = values
+
+    def flush(self):
+        """
+        Returns the coalesced frame as a dict with ``time`` and ``data`` (plus
+        ``min`` and ``max`` in minmax mode), or None if no frame arrived since
+        the last flush.
+        """
+        if self.count == 0:
+            return None
+        frame = {"time": self.time, "data": self.latest}
+        if self.mode == MEAN:
+            frame["data"] = self.total / self.count
+        elif self.mode == MINMAX:
+            frame["min"] = self.min
+            frame["max"] = self.max
+        self.count = 0
+        return frame
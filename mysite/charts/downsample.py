@@ -0,0 +1,50 @@
+import numpy as np
+
+
+def time_window(times, start=None, end=None):
+    """
+    Returns the slice of a sorted time array that lies within [start, end].
+    """
+    lo = 0 if start is None else int(np.searchsorted(times, start, side='left'))
+    hi = len(times) if end is None else int(np.searchsorted(times, end, side='right'))
+    return slice(lo, max(lo, hi))
+
+
+def minmax_downsample(times, columns, max_points):
+    """
+    Reduces a trial to at most ``max_points`` points with a min/max per bucket.
+
+    The samples are split into ``max_points // 2`` equal buckets. Every bucket
+    yields two points per column: its minimum and maximum, in the order they
+    occur, so peaks survive any reduction. All columns share the time axis,
+    which takes the first and last timestamp of each bucket. Everything is
+    computed with whole-array operations.
+    """
+    n = len(times)
+    buckets = max_points // 2
+    if n <= max_points or buckets < 1:
+        return times, columns
+
+    size = -(-n // buckets)
+    buckets = -(-n // size)
+    starts = np.arange(buckets) * size
+    ends = np.minimum(starts + size, n) - 1
+    out_times = np.empty(2 * buckets, dtype=times.dtype)
+    out_times[0::2] = times[starts]
+    out_times[1::2] = times[ends]
+
+    out_columns = {}
+    for name, values in columns.items():
+        # Pad the last bucket so all buckets can be reduced as one 2-D array
+        padded = np.full(buckets * size, np.nan, dtype=np.float64)
+        padded[:n] = values
+        padded = padded.reshape(buckets, size)
+        missing = np.isnan(padded)
+        lo = np.where(missing, np.inf, padded).argmin(axis=1)
+        hi = np.where(missing, -np.inf, padded).argmax(axis=1)
+        rows = np.arange(buckets)
+        out = np.empty(2 * buckets, dtype=values.dtype)
+        out[0::2] = padded[rows, np.minimum(lo, hi)]
+        out[1::2] = padded[rows, np.maximum(lo, hi)]
+        out_columns[name] = out
+    return out_times, out_columns
@@ -0,0 +1,166 @@
+import base64
+import bisect
+import collections
+import fnmatch
+import json
+import os
+import threading
+import time
+
+# Keys listings can be sorted by, prefixed with '-' for descending order
+SORT_KEYS = ('name', 'mtime', 'size')
+
+# Most entries a page may hold
+MAX_PAGE_SIZE = 1000
+
+# Seconds a snapshot is reused while its directory's version is unchanged,
+# since modifying an entry in place does not change the version
+SNAPSHOT_MAX_AGE = 30.0
+
+# Snapshots kept in memory
+MAX_SNAPSHOTS = 64
+
+
+class InvalidCursor(ValueError):
+    """
+    Raised when a cursor is malformed or belongs to another sort order.
+    """
+
+
+def encode_cursor(sort, entry):
+    value = json.dumps([sort, entry[sort], entry["name"]]).encode()
+    return base64.urlsafe_b64encode(value).decode().rstrip('=')
+
+
+def decode_cursor(cursor, sort):
+    try:
+        value = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        cursor_sort, sort_value, name = value
+    except (ValueError, TypeError):
+        raise InvalidCursor("Invalid cursor")
+    if cursor_sort != sort:
+        raise InvalidCursor("The cursor belongs to another sort order")
+    # The values are compared with the entries' keys, so their types must match
+    value_type = str if sort == 'name' else (int, float)
+    if not isinstance(name, str) or not isinstance(sort_value, value_type) or isinstance(sort_value, bool):
+        raise InvalidCursor("Invalid cursor")
+    return sort_value, name
+
+
+class Listing:
+    """
+    Entries of a directory, each a dict with at least a name and whether it
+    is a directory, sorted by each key once it is asked for.
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.orders = {}
+        self.lock = threading.Lock()
+
+    def ordered(self, sort):
+        # Entries and their keys in ascending order of (sort value, name)
+        with self.lock:
+            if sort not in self.orders:
+                entries = sorted(self.entries, key=lambda entry: (entry[sort], entry["name"]))
+                self.orders[sort] = (entries, [(entry[sort], entry["name"]) for entry in entries])
+            return self.orders[sort]
+
+    def page(self, sort='name', descending=False, dirs=None, prefix=None, pattern=None, cursor=None, limit=None):
+        """
+        Returns the names of the entries after ``cursor`` in the given order,
+        at most ``limit`` of them, and the cursor of the next page or None.
+
+        ``dirs`` keeps only directories (True) or files (False), ``prefix``
+        and ``pattern`` (a glob) filter on the name.
+        """
+        entries, keys = self.ordered(sort)
+        if cursor is None:
+            idx = len(entries) - 1 if descending else 0
+        elif descending:
+            idx = bisect.bisect_left(keys, decode_cursor(cursor, sort)) - 1
+        else:
+            idx = bisect.bisect_right(keys, decode_cursor(cursor, sort))
+        step = -1 if descending else 1
+
+        names = []
+        last = None
+        while 0 <= idx < len(entries):
+            entry = entries[idx]
+            idx += step
+            if dirs is not None and entry["dir"] != dirs:
+                continue
+            if prefix and not entry["name"].startswith(prefix):
+                continue
+            if pattern and not fnmatch.fnmatchcase(entry["name"], pattern):
+                continue
+            if limit is not None and len(names) == limit:
+                return names, encode_cursor(sort, last)
+            names.append(entry["name"])
+            last = entry
+        return names, None
+
+
+def name_listing(names):
+    """
+    Listing of subdirectories known by name only, which can only be paged
+    in name order.
+    """
+    return Listing([{"name": name, "dir": True} for name in names])
+
+
+class DirectorySnapshot(Listing):
+    """
+    Entries of a directory with their type, size and modification time,
+    taken in one pass.
+    """
+
+    def __init__(self, path):
+        self.created = time.monotonic()
+        entries = []
+        with os.scandir(path) as scan:
+            for entry in scan:
+                if entry.name.startswith('.'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append({
+                    "name": entry.name,
+                    "dir": entry.is_dir(),
+                    "size": stat.st_size,
+                    "mtime": stat.st_mtime,
+                })
+        super().__init__(entries)
+
+
+class SnapshotCache:
+    """
+    LRU cache of directory snapshots, each kept while the version given
+    for its directory is unchanged and for at most SNAPSHOT_MAX_AGE.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, path, version):
+        with self.lock:
+            cached = self.entries.get(path)
+            if cached and cached[0] == version and time.monotonic() - cached[1].created < SNAPSHOT_MAX_AGE:
+                self.entries.move_to_end(path)
+                return cached[1]
+
+        snapshot = DirectorySnapshot(path)
+        with self.lock:
+            self.entries[path] = (version, snapshot)
+            self.entries.move_to_end(path)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return snapshot
+
+
+# Directory snapshots shared by the listing views of this process
+directory_snapshots = SnapshotCache(MAX_SNAPSHOTS)
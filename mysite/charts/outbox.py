@@ -0,0 +1,152 @@
+import asyncio
+import collections
+import time
+import weakref
+
+# Policies applied when a client's outbox is full
+DROP_OLDEST = 'drop-oldest'
+DROP_NEWEST = 'drop-newest'
+DISCONNECT = 'disconnect'
+
+POLICIES = (DROP_OLDEST, DROP_NEWEST, DISCONNECT)
+
+# Process-wide counters of all outboxes
+counters = {
+    "queued": 0,
+    "sent": 0,
+    "acked": 0,
+    "dropped": 0,
+    "disconnected": 0,
+}
+
+_outboxes = weakref.WeakSet()
+
+
+def stats():
+    """
+    Returns the counters together with the number of open outboxes, the
+    frames currently waiting in them and the messages their clients have
+    not acknowledged yet.
+    """
+    outboxes = list(_outboxes)
+    return dict(
+        counters,
+        clients=len(outboxes),
+        pending=sum(len(outbox.queue) for outbox in outboxes),
+        unacked=sum(len(outbox.unacked) for outbox in outboxes),
+    )
+
+
+class Outbox:
+    """
+    Bounded queue of outgoing frames, drained by a sender task.
+
+    A websocket send returns as soon as the server has buffered the message,
+    daphne never waits for the client, so only the client can tell how far
+    behind it is. Clients that acknowledge what they received (see ``ack``)
+    are charged for the messages they have not acknowledged yet: queued and
+    unacknowledged frames together never exceed ``maxsize``, and the sender
+    waits for acknowledgements before writing more. For clients that do not
+    acknowledge, only the frames not yet handed to ``send`` are counted.
+
+    When the outbox is full the policy decides which frame is dropped. With
+    the disconnect policy new frames are dropped and ``put`` returns False
+    once the oldest queued or unacknowledged frame has waited longer than
+    ``max_lag`` seconds.
+    """
+
+    def __init__(self, send, maxsize, policy=DROP_OLDEST, max_lag=5.0, acks=False):
+        if policy not in POLICIES:
+            raise ValueError("Unknown send queue policy '%s'" % policy)
+        self.send = send
+        self.maxsize = maxsize
+        self.policy = policy
+        self.max_lag = max_lag
+        self.acks = acks
+        self.queue = collections.deque()
+        # Times the messages the client has not acknowledged yet were written
+        self.unacked = collections.deque()
+        self.written = 0
+        self.ready = asyncio.Event()
+        self.task = None
+        self.stopped = False
+        _outboxes.add(self)
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    def stop(self):
+        self.stopped = True
+        if self.task:
+            self.task.cancel()
+        self.queue.clear()
+        self.unacked.clear()
+        _outboxes.discard(self)
+
+    def wrote(self):
+        """
+        Counts a message written to the client, frames of the outbox as well
+        as any other message, since the client acknowledges all of them.
+        """
+        self.written += 1
+        if self.acks:
+            self.unacked.append(time.monotonic())
+
+    def ack(self, received):
+        """
+        Records that the client has received ``received`` messages in total.
+        """
+        if not isinstance(received, int) or isinstance(received, bool) or not 0 <= received <= self.written:
+            raise ValueError("received must be the number of messages received so far")
+        acked = len(self.unacked) - (self.written - received)
+        for _ in range(max(acked, 0)):
+            self.unacked.popleft()
+        counters["acked"] += max(acked, 0)
+        self.ready.set()
+
+    def depth(self):
+        """
+        Frames the client has yet to receive, queued or unacknowledged.
+        """
+        return len(self.queue) + len(self.unacked)
+
+    def lag(self):
+        """
+        Seconds the oldest queued or unacknowledged frame has been waiting.
+        """
+        oldest = []
+        if self.unacked:
+            oldest.append(self.unacked[0])
+        if self.queue:
+            oldest.append(self.queue[0][0])
+        if not oldest:
+            return 0.0
+        return time.monotonic() - min(oldest)
+
+    def put(self, frame):
+        """
+        Queues a frame, returns False if the client has fallen too far behind.
+        """
+        if self.policy == DISCONNECT and self.lag() > self.max_lag:
+            counters["disconnected"] += 1
+            return False
+        if self.depth() >= self.maxsize:
+            counters["dropped"] += 1
+            # Frames already written cannot be taken back
+            if self.policy != DROP_OLDEST or not self.queue:
+                return True
+            self.queue.popleft()
+        self.queue.append((time.monotonic(), frame))
+        counters["queued"] += 1
+        self.ready.set()
+        return True
+
+    async def run(self):
+        while True:
+            if not self.queue or len(self.unacked) >= self.maxsize:
+                self.ready.clear()
+                await self.ready.wait()
+                continue
+            _, frame = self.queue.popleft()
+            await self.send(frame)
+            counters["sent"] += 1
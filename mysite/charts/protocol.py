@@ -0,0 +1,41 @@
+import numpy as np
+
+# Websocket subprotocol offered by clients that want packed binary IK frames
+BINARY_SUBPROTOCOL = 'ik.f32.v1'
+
+
+def frame_dtype(width):
+    """
+    Layout of one binary frame: a float64 timestamp followed by ``width``
+    float32 values, little-endian and without padding.
+    """
+    return np.dtype([('time', '<f8'), ('values', '<f4', (width,))])
+
+
+def schema_message(topic, columns):
+    """
+    JSON message describing the binary frames that follow it.
+    """
+    return {
+        "op": "schema",
+        "topic": topic,
+        "columns": columns,
+        "time": "<f8",
+        "values": "<f4",
+        "frame_bytes": frame_dtype(len(columns)).itemsize
+    }
+
+
+def pack_frames(times, values):
+    """
+    Packs one frame or a batch of frames into a single binary message.
+
+    ``times`` is a scalar or an array of shape (m,), ``values`` an array of
+    shape (n,) or (m, n). A message always holds a whole number of frames.
+    """
+    times = np.atleast_1d(times)
+    values = np.atleast_2d(values)
+    frames = np.empty(len(times), dtype=frame_dtype(values.shape[1]))
+    frames['time'] = times
+    frames['values'] = values
+    return frames.tobytes()
@@ -0,0 +1,183 @@
+import json
+import asyncio
+import os
+import queue
+import threading
+import uuid
+import logging
+
+import numpy as np
+from django.conf import settings
+
+from . import upstream
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILENAME = 'index.json'
+
+# Active recordings of this process, keyed by id
+_recordings = {}
+
+
+class Recorder:
+    """
+    Records the frames of a topic into chunked files in a directory.
+
+    Frames are buffered in memory and every ``chunk_frames`` frames the chunk
+    is handed to a background writer thread. Frames with numeric data are
+    stored columnar, as one ``.npy`` array per chunk whose first column is the
+    timestamp. Any other message is stored as a ``.jsonl`` chunk. The
+    writer keeps ``index.json`` up to date with the chunks written so far.
+    """
+
+    def __init__(self, topic, directory, chunk_frames, columns=None):
+        self.topic = topic
+        self.directory = directory
+        self.chunk_frames = chunk_frames
+        self.columns = columns
+        self.index = {"topic": topic, "rows": 0, "chunks": []}
+        self.chunk = None
+        self.rows = 0
+        self.records = []
+        self.chunk_columns = None
+        self.queue = queue.Queue()
+        os.makedirs(directory, exist_ok=True)
+        self.thread = threading.Thread(target=self.write_chunks, daemon=True)
+        self.thread.start()
+
+    def add(self, data):
+        msg = data.get('msg', {})
+        try:
+            values = np.asarray(msg['data'], dtype=np.float64)
+            if values.ndim != 1:
+                raise ValueError("not a flat array")
+        except (KeyError, TypeError, ValueError):
+            self.add_record(data)
+            return
+
+        # Start a new chunk when the frame width changes or records are pending
+        if self.records or (self.chunk is not None and self.chunk.shape[1] != len(values) + 1):
+            self.flush()
+        if self.chunk is None:
+            self.chunk = np.empty((self.chunk_frames, len(values) + 1))
+            self.chunk_columns = ['time'] + self.column_names(len(values))
+        time = msg.get('time')
+        self.chunk[self.rows, 0] = np.nan if time is None else time
+        self.chunk[self.rows, 1:] = values
+        self.rows += 1
+        if self.rows == self.chunk_frames:
+            self.flush()
+
+    def add_record(self, data):
+        if self.chunk is not None:
+            self.flush()
+        self.records.append(data)
+        if len(self.records) == self.chunk_frames:
+            self.flush()
+
+    def column_names(self, width):
+        if self.columns:
+            return self.columns(width)
+        return ['value_%d' % idx for idx in range(width)]
+
+    def flush(self):
+        """
+        Hands the buffered frames to the writer thread.
+        """
+        if self.chunk is not None and self.rows:
+            self.queue.put((self.chunk[:self.rows], self.chunk_columns))
+        if self.records:
+            self.queue.put((self.records, None))
+        self.chunk = None
+        self.rows = 0
+        self.records = []
+
+    def close(self):
+        """
+        Writes the remaining frames and waits for the writer thread to finish.
+        """
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
+
+    def write_chunks(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            frames, columns = item
+            try:
+                self.write_chunk(frames, columns)
+            except Exception as e:
+                logger.error("Failed to write recording chunk of %s: %s", self.topic, str(e))
+
+    def write_chunk(self, frames, columns):
+        number = len(self.index["chunks"])
+        if columns is not None:
+            filename = 'chunk_%06d.npy' % number
+            np.save(os.path.join(self.directory, filename), frames)
+            entry = {
+                "file": filename,
+                "rows": len(frames),
+                "columns": columns,
+                "start": float(frames[0, 0]),
+                "end": float(frames[-1, 0])
+            }
+        else:
+            filename = 'chunk_%06d.jsonl' % number
+            with open(os.path.join(self.directory, filename), 'w') as chunk_file:
+                for record in frames:
+                    chunk_file.write(json.dumps(record) + '\n')
+            entry = {"file": filename, "rows": len(frames)}
+        self.index["chunks"].append(entry)
+        self.index["rows"] += entry["rows"]
+
+        # Replace the index atomically so readers never see a partial file
+        index_path = os.path.join(self.directory, INDEX_FILENAME)
+        with open(index_path + '.tmp', 'w') as index_file:
+            json.dump(self.index, index_file)
+        os.replace(index_path + '.tmp', index_path)
+
+
+async def start(topic, directory):
+    """
+    Starts recording a topic into a directory, keeping its shared upstream
+    subscription alive until the recording is stopped. Returns the recording id.
+    """
+    subscription = upstream.acquire(topic)
+    recorder = Recorder(
+        topic,
+        directory,
+        settings.RECORDING_CHUNK_FRAMES,
+        getattr(subscription, 'columns', None),
+    )
+    subscription.recorders.add(recorder)
+    recording_id = uuid.uuid4().hex
+    _recordings[recording_id] = (subscription, recorder)
+    logger.info("Recording %s into %s", topic, directory)
+    return recording_id
+
+
+async def stop(recording_id):
+    """
+    Stops a recording and waits for its remaining frames to be written.
+    Returns the recording index, or None if there is no such recording.
+    """
+    if recording_id not in _recordings:
+        return None
+    subscription, recorder = _recordings.pop(recording_id)
+    subscription.recorders.discard(recorder)
+    upstream.release(subscription)
+    await asyncio.get_running_loop().run_in_executor(None, recorder.close)
+    logger.info("Stopped recording %s into %s", recorder.topic, recorder.directory)
+    return recorder.index
+
+
+def active():
+    """
+    Lists the active recordings.
+    """
+    return [
+        {"recording_id": recording_id, "topic": recorder.topic, "directory": recorder.directory}
+        for recording_id, (subscription, recorder) in _recordings.items()
+    ]
@@ -0,0 +1,69 @@
+import json
+
+import numpy as np
+from django.http import HttpResponse
+from rest_framework.renderers import BaseRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _prepare(value, precision):
+    # Hand orjson plain contiguous arrays, rounded to the requested precision
+    if isinstance(value, dict):
+        return {key: _prepare(item, precision) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_prepare(item, precision) for item in value]
+    if isinstance(value, np.ndarray):
+        value = np.ascontiguousarray(value)
+        if precision is not None and value.dtype.kind == 'f':
+            value = np.round(value, precision)
+        return value
+    return value
+
+
+def _default(value):
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    raise TypeError("Object of type %s is not JSON serializable" % type(value).__name__)
+
+
+def dumps(data, precision=None):
+    """
+    Serializes data to JSON bytes, encoding NumPy arrays natively.
+
+    Floats in arrays are rounded to ``precision`` decimals if given. orjson
+    is used when installed, the standard library encoder otherwise.
+    """
+    data = _prepare(data, precision)
+    if orjson is not None:
+        return orjson.dumps(data, default=_default, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(data, default=_default).encode()
+
+
+class FastJsonResponse(HttpResponse):
+    """
+    Drop-in replacement for JsonResponse that serializes with ``dumps``.
+    """
+
+    def __init__(self, data, safe=True, precision=None, **kwargs):
+        if safe and not isinstance(data, dict):
+            raise TypeError("In order to allow non-dict objects to be serialized set the safe parameter to False.")
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(content=dumps(data, precision), **kwargs)
+
+
+class FastJSONRenderer(BaseRenderer):
+    """
+    REST framework renderer that serializes with ``dumps``.
+    """
+    media_type = 'application/json'
+    format = 'json'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return dumps(data)
@@ -0,0 +1,46 @@
+import numpy as np
+
+
+class FrameRing:
+    """
+    Preallocated ring buffer of the most recent frames and their timestamps.
+
+    The value buffer is allocated on the first frame, once the frame width is
+    known, and reallocated (dropping the history) if the width changes.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.times = np.full(capacity, np.nan)
+        self.values = None
+        # Total number of frames ever appended
+        self.count = 0
+
+    def append(self, time, values):
+        values = np.asarray(values, dtype=np.float64)
+        if self.values is None or self.values.shape[1] != len(values):
+            self.values = np.empty((self.capacity, len(values)))
+            self.count = 0
+        idx = self.count % self.capacity
+        self.times[idx] = np.nan if time is None else time
+        self.values[idx] = values
+        self.count += 1
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def snapshot(self, seconds=None):
+        """
+        Returns copies of the buffered timestamps and frames in chronological
+        order, limited to the last ``seconds`` if given.
+        """
+        if self.values is None:
+            return np.empty(0), np.empty((0, 0))
+        idx = np.arange(self.count - len(self), self.count) % self.capacity
+        times = self.times[idx]
+        values = self.values[idx]
+        if seconds is not None and len(times) and not np.isnan(times[-1]):
+            keep = times >= times[-1] - seconds
+            times = times[keep]
+            values = values[keep]
+        return times, values
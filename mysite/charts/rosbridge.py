@@ -0,0 +1,78 @@
+import base64
+import json
+
+import cbor2
+import numpy as np
+
+# Compression modes rosbridge supports on subscribe
+COMPRESSIONS = ('none', 'cbor', 'cbor-raw')
+
+# Subscribe options that may be configured per topic
+SUBSCRIBE_OPTIONS = ('compression', 'throttle_rate', 'queue_length')
+
+# CBOR typed array tags (RFC 8746) rosbridge uses for numeric arrays
+TYPED_ARRAY_DTYPES = {
+    64: 'u1',
+    69: '<u2',
+    70: '<u4',
+    71: '<u8',
+    72: 'i1',
+    77: '<i2',
+    78: '<i4',
+    79: '<i8',
+    85: '<f4',
+    86: '<f8',
+}
+
+
+def subscribe_message(topic, options):
+    """
+    Builds the rosbridge subscribe op for a topic from its configured options.
+    """
+    message = {
+        "op": "subscribe",
+        "topic": topic
+    }
+    for key in SUBSCRIBE_OPTIONS:
+        if options.get(key) is not None:
+            message[key] = options[key]
+    if message.get("compression", "none") not in COMPRESSIONS:
+        raise ValueError("Unsupported rosbridge compression '%s'" % message["compression"])
+    return message
+
+
+def _typed_array(*args):
+    # cbor2 5 calls tag hooks with (decoder, tag), cbor2 6 with (tag, immutable)
+    tag = args[1] if isinstance(args[1], cbor2.CBORTag) else args[0]
+    dtype = TYPED_ARRAY_DTYPES.get(tag.tag)
+    if dtype is None:
+        return tag
+    return np.frombuffer(tag.value, dtype=dtype)
+
+
+def decode_message(message):
+    """
+    Decodes a rosbridge message: text frames are JSON, binary frames CBOR.
+
+    Numeric arrays of CBOR messages are decoded straight into NumPy arrays.
+    """
+    if isinstance(message, bytes):
+        return cbor2.loads(message, tag_hook=_typed_array)
+    return json.loads(message)
+
+
+def to_builtin(value):
+    """
+    Converts a decoded message into plain lists, dicts and scalars that the
+    channel layer and JSON clients can handle. Byte strings are base64
+    encoded, as rosbridge does for uint8 arrays in JSON.
+    """
+    if isinstance(value, dict):
+        return {key: to_builtin(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [to_builtin(item) for item in value]
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode('ascii')
+    return value
@@ -1,7 +1,9 @@
 from django.urls import path
-from .consumers import BridgeConsumer, LogConsumer
+from .consumers import BridgeConsumer, LogConsumer, TopicGatewayConsumer, TreeConsumer
 
 websocket_urlpatterns = [
     path('ws/bridge/', BridgeConsumer.as_asgi()),
-    path('ws/flexbelogs/', LogConsumer.as_asgi())
+    path('ws/flexbelogs/', LogConsumer.as_asgi()),
+    path('ws/topics/', TopicGatewayConsumer.as_asgi()),
+    path('ws/tree/', TreeConsumer.as_asgi())
 ]
@@ -0,0 +1,118 @@
+import json
+import os
+import shutil
+import threading
+import logging
+
+import numpy as np
+
+from .storage import is_storage_file
+from .trials import MissingColumns, parse_trial, read_column_names, trial_cache
+
+logger = logging.getLogger(__name__)
+
+HEADER_FILENAME = 'header.json'
+
+
+def sidecar_path(file_path):
+    """
+    Hidden directory next to a storage file holding its columns, e.g.
+    ``.trial.mot.cols`` for ``trial.mot``.
+    """
+    directory, name = os.path.split(file_path)
+    return os.path.join(directory, '.%s.cols' % name)
+
+
+def read_header(file_path):
+    """
+    Returns the sidecar header of a file if it matches the file on disk.
+    """
+    try:
+        with open(os.path.join(sidecar_path(file_path), HEADER_FILENAME)) as header_file:
+            header = json.load(header_file)
+    except (OSError, ValueError):
+        return None
+    stat = os.stat(file_path)
+    if header.get("mtime_ns") != stat.st_mtime_ns or header.get("size") != stat.st_size:
+        return None
+    return header
+
+
+def build_sidecar(file_path):
+    """
+    Parses a storage file once and writes each column as a contiguous .npy
+    file, plus a JSON header with the column names and the source's
+    modification time and size. Returns the header.
+    """
+    stat = os.stat(file_path)
+    columns = read_column_names(file_path)
+    trial = parse_trial(file_path, columns)
+
+    # Write into a temporary directory and swap it in, so readers never see
+    # a partial sidecar
+    path = sidecar_path(file_path)
+    tmp_path = '%s.%d-%d.tmp' % (path, os.getpid(), threading.get_ident())
+    os.makedirs(tmp_path)
+    try:
+        files = {}
+        for idx, col in enumerate(columns):
+            files[col] = 'col_%04d.npy' % idx
+            np.save(os.path.join(tmp_path, files[col]), trial[col])
+        header = {
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "rows": len(trial[columns[0]]) if columns else 0,
+            "columns": columns,
+            "files": files
+        }
+        with open(os.path.join(tmp_path, HEADER_FILENAME), 'w') as header_file:
+            json.dump(header, header_file)
+
+        if os.path.exists(path):
+            shutil.rmtree(path, ignore_errors=True)
+        os.rename(tmp_path, path)
+    except OSError:
+        # Another request may have swapped in its sidecar first
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        if read_header(file_path) is None:
+            raise
+    logger.info("Wrote binary sidecar of %s", file_path)
+    return header
+
+
+def load_columns(file_path, columns=None):
+    """
+    Memory-maps the requested columns of a storage file, or all of them,
+    from its sidecar, building the sidecar first if it is missing or older
+    than the file.
+    """
+    header = read_header(file_path) or build_sidecar(file_path)
+    if columns is None:
+        columns = header["columns"]
+    missing = [col for col in columns if col not in header["files"]]
+    if missing:
+        raise MissingColumns('Some columns are missing in the file: %s' % ', '.join(missing))
+    path = sidecar_path(file_path)
+    return {col: np.load(os.path.join(path, header["files"][col]), mmap_mode='r') for col in columns}
+
+
+def load_trial(file_path, columns):
+    """
+    Loads the requested columns of a trial file through the trial cache.
+
+    OpenSim storage files are cached once as memory maps of all the columns
+    of their sidecar, and each request picks its columns from them. Any
+    other file, or a storage file whose sidecar cannot be written, is
+    parsed and cached per set of columns.
+    """
+    if is_storage_file(file_path):
+        try:
+            trial = trial_cache.get(file_path, lambda: load_columns(file_path), ('sidecar',))
+        except OSError as e:
+            logger.warning("Cannot use a sidecar for %s: %s", file_path, str(e))
+        else:
+            missing = [col for col in columns if col not in trial]
+            if missing:
+                raise MissingColumns('Some columns are missing in the file: %s' % ', '.join(missing))
+            return {col: trial[col] for col in columns}
+    return trial_cache.get(file_path, lambda: parse_trial(file_path, columns), columns)
@@ -0,0 +1,217 @@
+import os
+import logging
+import warnings
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# OpenSim storage file extensions
+STORAGE_EXTENSIONS = ('.mot', '.sto')
+
+# Line that closes the header of a storage file
+END_HEADER = 'endheader'
+
+# Header lines read at most while looking for END_HEADER
+MAX_HEADER_LINES = 1000
+
+
+class StorageFormatError(ValueError):
+    """
+    Raised when a file is not a readable OpenSim storage file.
+    """
+
+
+def is_storage_file(file_path):
+    return file_path.endswith(STORAGE_EXTENSIONS)
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def read_storage_header(file_path):
+    """
+    Parses the header of an OpenSim .mot/.sto file.
+
+    Returns a dict with the file's name, version, row and column counts,
+    whether angles are in degrees (None when the header does not say), the
+    column labels and the number of lines before the numeric body. Both the
+    ``key=value`` header and the legacy ``datarows``/``datacolumns`` header
+    are understood, and unknown lines are skipped.
+    """
+    header = {
+        "name": None,
+        "version": None,
+        "rows": None,
+        "columns": None,
+        "in_degrees": None,
+        "labels": [],
+        "header_lines": 0,
+    }
+    with open(file_path, 'rb') as storage_file:
+        for idx in range(MAX_HEADER_LINES):
+            raw = storage_file.readline()
+            if not raw:
+                break
+            line = raw.decode('utf-8', 'replace').strip()
+            if line.lower() == END_HEADER:
+                break
+            if idx == 0 and '=' not in line:
+                header["name"] = line
+            elif '=' in line:
+                key, value = (part.strip() for part in line.split('=', 1))
+                if key == 'version':
+                    header["version"] = _int(value)
+                elif key == 'nRows':
+                    header["rows"] = _int(value)
+                elif key == 'nColumns':
+                    header["columns"] = _int(value)
+                elif key == 'inDegrees':
+                    header["in_degrees"] = value.lower() == 'yes'
+            elif line.startswith(('datarows', 'datacolumns')):
+                key, _, value = line.partition(' ')
+                header["rows" if key == 'datarows' else "columns"] = _int(value)
+        else:
+            raise StorageFormatError("No %s within %d lines of %s" % (END_HEADER, MAX_HEADER_LINES, file_path))
+        if not raw:
+            raise StorageFormatError("No %s in %s" % (END_HEADER, file_path))
+
+        header["labels"] = storage_file.readline().decode('utf-8', 'replace').split()
+        header["header_lines"] = idx + 2
+
+    if not header["labels"]:
+        raise StorageFormatError("No column labels in %s" % file_path)
+    if header["columns"] is not None and header["columns"] != len(header["labels"]):
+        logger.warning("%s declares %d columns but labels %d", file_path, header["columns"], len(header["labels"]))
+    return header
+
+
+def _read_table(file_path, header, usecols):
+    # Parse the given columns of the body into a float64 table, one row per line
+    try:
+        table = np.loadtxt(
+            file_path, dtype=np.float64, skiprows=header["header_lines"], usecols=usecols, ndmin=2
+        )
+    except ValueError as e:
+        raise StorageFormatError("Cannot parse %s: %s" % (file_path, str(e)))
+    if header["rows"] is not None and header["rows"] != len(table):
+        logger.warning("%s declares %d rows but holds %d", file_path, header["rows"], len(table))
+    return table
+
+
+def read_storage(file_path, columns, dtypes, header=None):
+    """
+    Reads the given columns of a storage file into NumPy arrays.
+
+    The numeric body is parsed in a single vectorized pass that converts
+    only the requested columns, and each column is copied into its own
+    contiguous array of the requested dtype.
+    """
+    header = header or read_storage_header(file_path)
+    if not columns:
+        return {}
+    index = {label: idx for idx, label in enumerate(header["labels"])}
+    table = _read_table(file_path, header, [index[col] for col in columns])
+
+    rows = len(table)
+    result = {}
+    for idx, col in enumerate(columns):
+        result[col] = np.empty(rows, dtype=dtypes[col])
+        result[col][:] = table[:, idx]
+    return result
+
+
+def _first_value(line):
+    try:
+        return float(line.split()[0])
+    except (IndexError, ValueError):
+        return None
+
+
+def describe_storage(file_path):
+    """
+    Summarizes a storage file from its header and its first and last rows,
+    without parsing the body: the column labels, the row count, the time
+    span of the rows and whether angles are in degrees.
+    """
+    header = read_storage_header(file_path)
+    with open(file_path, 'rb') as storage_file:
+        for _ in range(header["header_lines"]):
+            storage_file.readline()
+        first = storage_file.readline()
+        body_start = storage_file.tell() - len(first)
+
+        rows = header["rows"]
+        if rows is None:
+            rows = sum(1 for line in storage_file if line.strip()) + (1 if first.strip() else 0)
+
+        # The last row is within the tail of the file
+        storage_file.seek(max(body_start, os.fstat(storage_file.fileno()).st_size - 4096))
+        lines = [line for line in storage_file.read().splitlines() if line.strip()]
+        last = lines[-1] if lines else b''
+
+    start, end = _first_value(first), _first_value(last)
+    return {
+        "columns": header["labels"],
+        "rows": rows,
+        "duration": end - start if start is not None and end is not None else None,
+        "in_degrees": header["in_degrees"],
+    }
+
+
+def _finite(value):
+    value = float(value)
+    return value if np.isfinite(value) else None
+
+
+def summarize_storage(file_path, header=None):
+    """
+    Computes the summary statistics of a storage file in one vectorized
+    pass over its body: the sample rate from the median step of the time
+    column, and the minimum, maximum, mean and range of every other column,
+    ignoring NaNs. Values that cannot be computed are None.
+    """
+    header = header or read_storage_header(file_path)
+    labels = header["labels"]
+    table = _read_table(file_path, header, list(range(len(labels)))) if labels else np.empty((0, 0))
+
+    sample_rate = None
+    coordinates = {label: {"min": None, "max": None, "mean": None, "range": None} for label in labels[1:]}
+    if len(table):
+        if len(table) > 1:
+            step = np.median(np.diff(table[:, 0]))
+            sample_rate = _finite(1.0 / step) if step > 0 else None
+
+        # Columns holding only NaNs warn and come out as NaN, reported as None
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            values = table[:, 1:]
+            minimum, maximum, mean = np.nanmin(values, axis=0), np.nanmax(values, axis=0), np.nanmean(values, axis=0)
+        for idx, label in enumerate(labels[1:]):
+            coordinates[label] = {
+                "min": _finite(minimum[idx]),
+                "max": _finite(maximum[idx]),
+                "mean": _finite(mean[idx]),
+                "range": _finite(maximum[idx] - minimum[idx]),
+            }
+    return {"sample_rate": sample_rate, "coordinates": coordinates}
+
+
+def angle_units(file_path):
+    """
+    Returns the units of the angles of a storage file as written in its
+    header, 'degrees' or 'radians', or None if it does not say.
+    """
+    if not is_storage_file(file_path):
+        return None
+    try:
+        in_degrees = read_storage_header(file_path)["in_degrees"]
+    except (OSError, StorageFormatError):
+        return None
+    if in_degrees is None:
+        return None
+    return 'degrees' if in_degrees else 'radians'
@@ -0,0 +1,46 @@
+import json
+
+from .renderers import dumps
+
+# Formats of streamed trial responses and their content types
+STREAM_FORMATS = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def json_chunks(columns, block_rows, precision=None):
+    """
+    Yields a JSON object of column arrays, ``{"col": [...], ...}``, encoding
+    ``block_rows`` values at a time.
+    """
+    yield b'{'
+    for idx, (name, values) in enumerate(columns.items()):
+        yield (b',' if idx else b'') + json.dumps(name).encode() + b':['
+        for start in range(0, len(values), block_rows):
+            yield (b',' if start else b'') + dumps(values[start:start + block_rows], precision)[1:-1]
+        yield b']'
+    yield b'}'
+
+
+def ndjson_chunks(columns, block_rows, precision=None):
+    """
+    Yields one JSON object per row, ``{"col": value, ...}``, encoding
+    ``block_rows`` rows at a time.
+    """
+    names = list(columns)
+    rows = len(columns[names[0]]) if names else 0
+    keys = [json.dumps(name).encode() + b':' for name in names]
+    for start in range(0, rows, block_rows):
+        # Encode each column of the block at once and split it into values
+        values = [dumps(columns[name][start:start + block_rows], precision)[1:-1].split(b',') for name in names]
+        yield b''.join(
+            b'{' + b','.join(key + value for key, value in zip(keys, row)) + b'}\n'
+            for row in zip(*values)
+        )
+
+
+def stream_chunks(columns, stream_format, block_rows, precision=None):
+    if stream_format == 'ndjson':
+        return ndjson_chunks(columns, block_rows, precision)
+    return json_chunks(columns, block_rows, precision)
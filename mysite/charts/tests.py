@@ -1,3 +1,230 @@
-from django.test import TestCase
+import base64
+import fnmatch
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.test import SimpleTestCase
+
+from .downsample import minmax_downsample
+from .listing import SORT_KEYS, InvalidCursor, Listing, encode_cursor
+from .ringbuffer import FrameRing
+
+
+# Entries with repeated sizes and times, so the name has to break ties
+ENTRIES = [
+    {"name": name, "dir": name.startswith('d'), "size": size, "mtime": mtime}
+    for name, size, mtime in [
+        ('a1.mot', 10, 5.0), ('a2.mot', 30, 1.0), ('a3.sto', 10, 3.0),
+        ('b1.mot', 20, 5.0), ('b2.sto', 30, 2.0), ('b3.mot', 10, 4.0),
+        ('c1.mot', 50, 5.0), ('c2.csv', 20, 6.0), ('dir1', 0, 7.0),
+        ('dir2', 0, 0.5), ('a4.mot', 40, 5.0),
+    ]
+]
+
+
+def page_through(listing, limit, **filters):
+    # Names of every page in turn, failing if the cursors do not advance
+    names, cursor = [], None
+    for _ in range(len(ENTRIES) + 1):
+        page, cursor = listing.page(cursor=cursor, limit=limit, **filters)
+        names.extend(page)
+        if cursor is None:
+            return names
+    raise AssertionError("The cursors never reached the end of the listing")
+
+
+class ListingPageTests(SimpleTestCase):
+    def expected(self, sort, descending, dirs=None, prefix=None, pattern=None):
+        entries = sorted(ENTRIES, key=lambda entry: (entry[sort], entry["name"]), reverse=descending)
+        return [
+            entry["name"] for entry in entries
+            if (dirs is None or entry["dir"] == dirs)
+            and (prefix is None or entry["name"].startswith(prefix))
+            and (pattern is None or fnmatch.fnmatchcase(entry["name"], pattern))
+        ]
+
+    def test_pages_hold_every_entry_once(self):
+        listing = Listing(ENTRIES)
+        for sort in SORT_KEYS:
+            for descending in (False, True):
+                for filters in ({}, {"prefix": 'a'}, {"pattern": '*.mot'}, {"dirs": False}):
+                    for limit in (1, 2, 3, 100):
+                        with self.subTest(sort=sort, descending=descending, limit=limit, **filters):
+                            names = page_through(listing, limit, sort=sort, descending=descending, **filters)
+                            self.assertEqual(names, self.expected(sort, descending, **filters))
+
+    def test_last_page_has_no_cursor(self):
+        names, cursor = Listing(ENTRIES).page(prefix='c', limit=2)
+        self.assertEqual(names, ['c1.mot', 'c2.csv'])
+        self.assertIsNone(cursor)
+
+    def test_cursor_of_another_order_is_rejected(self):
+        listing = Listing(ENTRIES)
+        _, cursor = listing.page(sort='size', limit=2)
+        with self.assertRaises(InvalidCursor):
+            listing.page(sort='mtime', cursor=cursor, limit=2)
+        with self.assertRaises(InvalidCursor):
+            listing.page(sort='name', cursor=cursor, limit=2)
+
+    def test_malformed_cursors_are_rejected(self):
+        listing = Listing(ENTRIES)
+        wrong_type = encode_cursor('size', {"size": 'ten', "name": 'a1.mot'})
+        wrong_shape = base64.urlsafe_b64encode(json.dumps(['size', 10]).encode()).decode()
+        for cursor in ('not a cursor', '!!!', wrong_type, wrong_shape):
+            with self.subTest(cursor=cursor), self.assertRaises(InvalidCursor):
+                listing.page(sort='size', cursor=cursor, limit=2)
+
+
+class ListingViewTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        for entry in ENTRIES:
+            path = os.path.join(self.directory, entry["name"])
+            if entry["dir"]:
+                os.mkdir(path)
+                continue
+            with open(path, 'wb') as datafile:
+                datafile.write(b'0' * entry["size"])
+            os.utime(path, (entry["mtime"], entry["mtime"]))
+        patcher = mock.patch('charts.views.DEFAULT_DIRECTORY', self.directory)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get(self, **params):
+        return self.client.get('/get_filenames/', params)
+
+    def test_pages_through_files(self):
+        files = [entry for entry in ENTRIES if not entry["dir"]]
+        for sort in ('name', '-name', 'size', '-mtime'):
+            with self.subTest(sort=sort):
+                key = sort.lstrip('-')
+                expected = [entry["name"] for entry in sorted(
+                    files, key=lambda entry: (entry[key], entry["name"]), reverse=sort.startswith('-'))]
+                names, cursor = [], None
+                while True:
+                    params = {"sort": sort, "limit": 4}
+                    if cursor:
+                        params["cursor"] = cursor
+                    response = self.get(**params)
+                    self.assertEqual(response.status_code, 200)
+                    body = response.json()
+                    names.extend(body["filenames"])
+                    cursor = body["next"]
+                    if cursor is None:
+                        break
+                self.assertEqual(names, expected)
+
+    def test_glob_filter(self):
+        response = self.get(glob='b*.mot', limit=10)
+        self.assertEqual(response.json(), {"filenames": ['b1.mot', 'b3.mot'], "next": None})
+
+    def test_malformed_cursor_is_a_bad_request(self):
+        response = self.get(cursor='garbage', limit=2)
+        self.assertEqual(response.status_code, 400)
+
+    def test_cursor_of_another_order_is_a_bad_request(self):
+        cursor = self.get(sort='size', limit=2).json()["next"]
+        response = self.get(sort='-mtime', cursor=cursor, limit=2)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("error", response.json())
+
+
+class MinMaxDownsampleTests(SimpleTestCase):
+    def test_short_trials_are_returned_unchanged(self):
+        times = np.arange(10.0)
+        columns = {"a": np.arange(10.0)}
+        self.assertIs(minmax_downsample(times, columns, 10)[1], columns)
+        self.assertIs(minmax_downsample(times, columns, 1)[0], times)
+
+    def test_output_fits_max_points(self):
+        for n, max_points in ((1000, 100), (1001, 100), (10, 6), (997, 7)):
+            with self.subTest(n=n, max_points=max_points):
+                times = np.arange(n, dtype=np.float64)
+                out_times, out_columns = minmax_downsample(times, {"a": np.sin(times)}, max_points)
+                self.assertLessEqual(len(out_times), max_points)
+                self.assertEqual(len(out_columns["a"]), len(out_times))
+                self.assertEqual(out_times[0], times[0])
+                self.assertEqual(out_times[-1], times[-1])
+                self.assertTrue(np.all(np.diff(out_times) >= 0))
+
+    def test_extremes_of_each_bucket_are_kept_in_order(self):
+        times = np.arange(8.0)
+        values = np.array([3.0, 1.0, 5.0, 2.0, 9.0, 0.0, 4.0, 4.0])
+        _, columns = minmax_downsample(times, {"a": values}, 4)
+        # Buckets [3, 1, 5, 2] and [9, 0, 4, 4]: min before max, then max before min
+        np.testing.assert_array_equal(columns["a"], [1.0, 5.0, 9.0, 0.0])
+
+    def test_peaks_survive(self):
+        values = np.zeros(10000)
+        values[1234] = 7.0
+        values[8765] = -3.0
+        _, columns = minmax_downsample(np.arange(10000.0), {"a": values}, 50)
+        self.assertEqual(columns["a"].max(), 7.0)
+        self.assertEqual(columns["a"].min(), -3.0)
+
+    def test_missing_values_and_padding_are_skipped(self):
+        values = np.arange(10, dtype=np.float32)
+        values[1] = np.nan
+        _, columns = minmax_downsample(np.arange(10.0), {"a": values}, 6)
+        self.assertFalse(np.isnan(columns["a"]).any())
+        self.assertEqual(columns["a"].dtype, np.float32)
+
+
+class FrameRingTests(SimpleTestCase):
+    def test_empty_snapshot(self):
+        times, values = FrameRing(4).snapshot()
+        self.assertEqual(times.shape, (0,))
+        self.assertEqual(values.shape, (0, 0))
+
+    def test_snapshot_is_chronological_after_wrapping(self):
+        ring = FrameRing(4)
+        for i in range(6):
+            ring.append(float(i), [i, -i])
+        times, values = ring.snapshot()
+        np.testing.assert_array_equal(times, [2.0, 3.0, 4.0, 5.0])
+        np.testing.assert_array_equal(values[:, 1], [-2.0, -3.0, -4.0, -5.0])
+
+    def test_snapshot_before_filling(self):
+        ring = FrameRing(4)
+        ring.append(0.0, [1.0])
+        ring.append(1.0, [2.0])
+        self.assertEqual(len(ring), 2)
+        np.testing.assert_array_equal(ring.snapshot()[1], [[1.0], [2.0]])
+
+    def test_snapshot_keeps_the_last_seconds(self):
+        ring = FrameRing(10)
+        for i in range(8):
+            ring.append(i * 0.5, [i])
+        times, values = ring.snapshot(seconds=1.0)
+        np.testing.assert_array_equal(times, [2.5, 3.0, 3.5])
+        np.testing.assert_array_equal(values[:, 0], [5.0, 6.0, 7.0])
+
+    def test_frames_without_time_are_kept_whole(self):
+        ring = FrameRing(4)
+        ring.append(0.0, [1.0])
+        ring.append(None, [2.0])
+        times, values = ring.snapshot(seconds=0.1)
+        self.assertEqual(len(values), 2)
+        self.assertTrue(np.isnan(times[-1]))
+
+    def test_snapshot_is_a_copy(self):
+        ring = FrameRing(4)
+        ring.append(0.0, [1.0])
+        times, values = ring.snapshot()
+        values[0, 0] = 99.0
+        times[0] = 99.0
+        np.testing.assert_array_equal(ring.snapshot()[1], [[1.0]])
+        np.testing.assert_array_equal(ring.snapshot()[0], [0.0])
+
+    def test_width_change_drops_the_history(self):
+        ring = FrameRing(4)
+        ring.append(0.0, [1.0, 2.0])
+        ring.append(1.0, [1.0, 2.0, 3.0])
+        times, values = ring.snapshot()
+        np.testing.assert_array_equal(times, [1.0])
+        self.assertEqual(values.shape, (1, 3))
@@ -0,0 +1,285 @@
+import asyncio
+import os
+import threading
+import time
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    FileSystemEventHandler = object
+    Observer = None
+
+logger = logging.getLogger(__name__)
+
+# Levels of the project hierarchy, from the projects directory down
+LEVELS = ('projects', 'subjects', 'sessions', 'datafiles')
+
+# Channel layer group that receives the changes of the project tree
+TREE_GROUP = 'projects.tree'
+
+# Seconds to wait for more filesystem events before applying them
+EVENT_DELAY = 0.2
+
+
+def scan_directory(path):
+    """
+    Lists the visible entries of a directory in one pass.
+
+    Returns the set of subdirectory names and a dict of file name to its
+    size and modification time. The entry type comes from the directory
+    listing itself, so only files are stat'ed.
+    """
+    dirs = set()
+    files = {}
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+            # An entry may vanish between the listing and the stat, e.g. a
+            # temporary file, which must not fail the whole directory
+            try:
+                if entry.is_dir():
+                    dirs.add(entry.name)
+                elif entry.is_file():
+                    stat = entry.stat()
+                    files[entry.name] = {"size": stat.st_size, "mtime": stat.st_mtime}
+            except OSError:
+                continue
+    return dirs, files
+
+
+class _EventHandler(FileSystemEventHandler):
+    def __init__(self, index):
+        self.index = index
+
+    def on_any_event(self, event):
+        self.index.notify(event.src_path)
+        if getattr(event, 'dest_path', None):
+            self.index.notify(event.dest_path)
+
+
+class ProjectIndex:
+    """
+    In-memory index of the project hierarchy.
+
+    Holds the listing of every directory down to the datafile folders,
+    keyed by its path relative to the root as a tuple, so listings are
+    answered without touching the disk. Directories are rescanned when
+    watchdog reports a change in them and all of them are reconciled every
+    ``reconcile_seconds``, which also covers filesystems without change
+    notifications such as NFS. Every change is sent to TREE_GROUP.
+    """
+
+    def __init__(self, root, reconcile_seconds):
+        self.root = root
+        self.reconcile_seconds = reconcile_seconds
+        self.entries = {}
+        self.version = 0
+        # ETags must not repeat across restarts of the server
+        self.epoch = '%x' % time.time_ns()
+        self.pending = set()
+        self.wake = threading.Event()
+        self.lock = threading.RLock()
+        self.started = False
+        self.observer = None
+        # Event loop of the tree consumers, changes are published on it
+        self.loop = None
+        # Callables that receive every list of changes, e.g. the catalog
+        self.listeners = []
+
+    def start(self):
+        """
+        Scans the tree and starts watching it, on first use.
+        """
+        with self.lock:
+            if self.started:
+                return
+            self._refresh(())
+            self.started = True
+
+        threading.Thread(target=self.run, name='project-index', daemon=True).start()
+        if Observer is not None:
+            try:
+                self.observer = Observer()
+                self.observer.schedule(_EventHandler(self), self.root, recursive=True)
+                self.observer.daemon = True
+                self.observer.start()
+            except OSError as e:
+                logger.warning("Cannot watch %s, relying on reconciliation: %s", self.root, str(e))
+                self.observer = None
+        logger.info("Indexed %d directories of %s", len(self.entries), self.root)
+
+    def run(self):
+        last_reconcile = time.monotonic()
+        while True:
+            timeout = max(0, last_reconcile + self.reconcile_seconds - time.monotonic())
+            if self.wake.wait(timeout):
+                # Let bursts of events, e.g. a file being written, settle
+                time.sleep(EVENT_DELAY)
+                self.wake.clear()
+                with self.lock:
+                    pending, self.pending = self.pending, set()
+                for rel in sorted(pending, key=len):
+                    self.refresh(rel)
+            else:
+                self.reconcile()
+                last_reconcile = time.monotonic()
+
+    def notify(self, path):
+        """
+        Marks the directory holding ``path`` for a rescan.
+        """
+        rel = os.path.relpath(path, self.root).split(os.sep)
+        if rel[0] in (os.curdir, os.pardir) or any(part.startswith('.') for part in rel):
+            return
+        parent = tuple(rel[:-1])
+        if len(parent) <= len(LEVELS):
+            with self.lock:
+                self.pending.add(parent)
+            self.wake.set()
+
+    def refresh(self, rel):
+        """
+        Rescans one directory now, e.g. right after creating an entry in it.
+        A directory that is not indexed yet is picked up by rescanning its
+        closest indexed parent.
+        """
+        self.start()
+        rel = tuple(rel)
+        with self.lock:
+            while rel and rel not in self.entries:
+                rel = rel[:-1]
+            changes = self._refresh(rel)
+        self.publish(changes)
+
+    def reconcile(self):
+        """
+        Rescans every indexed directory to catch changes that were missed.
+        """
+        changes = []
+        with self.lock:
+            rels = sorted(self.entries, key=len)
+        # Lock per directory so listings are not held up by a slow walk
+        for rel in rels:
+            with self.lock:
+                if rel in self.entries:
+                    changes += self._refresh(rel)
+        if changes:
+            logger.info("Reconciliation found %d changes in %s", len(changes), self.root)
+        self.publish(changes)
+
+    def _refresh(self, rel):
+        # Rescan a directory, indexing new subdirectories and dropping removed ones
+        try:
+            dirs, files = scan_directory(os.path.join(self.root, *rel))
+        except OSError:
+            return self._drop(rel)
+
+        old = self.entries.get(rel)
+        old_dirs = old["dirs"] if old else set()
+        changes = []
+        if old is None or old["dirs"] != dirs or old["files"] != files:
+            self.version += 1
+            self.entries[rel] = {"dirs": dirs, "files": files, "version": self.version}
+            changes.append(self._change(rel))
+        for name in old_dirs - dirs:
+            changes += self._drop(rel + (name,))
+        if len(rel) < len(LEVELS):
+            for name in dirs - old_dirs:
+                changes += self._refresh(rel + (name,))
+        return changes
+
+    def _drop(self, rel):
+        if rel not in self.entries:
+            return []
+        self.version += 1
+        for key in [key for key in self.entries if key[:len(rel)] == rel]:
+            del self.entries[key]
+        return [{"change": "removed", "path": list(rel)}]
+
+    def _change(self, rel):
+        entry = self.entries[rel]
+        return {"change": "updated", "path": list(rel), "dirs": sorted(entry["dirs"]), "files": entry["files"]}
+
+    def publish(self, changes):
+        if not changes:
+            return
+        for listener in list(self.listeners):
+            try:
+                listener(changes)
+            except Exception as e:
+                logger.error("Project tree listener failed: %s", str(e))
+
+        channel_layer = get_channel_layer()
+        if channel_layer is None:
+            return
+        message = {"type": "tree.change", "changes": changes}
+        if self.loop is not None and self.loop.is_running():
+            future = asyncio.run_coroutine_threadsafe(channel_layer.group_send(TREE_GROUP, message), self.loop)
+            future.add_done_callback(self._published)
+            return
+        try:
+            async_to_sync(channel_layer.group_send)(TREE_GROUP, message)
+        except Exception as e:
+            logger.error("Cannot publish project tree changes: %s", str(e))
+
+    def _published(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("Cannot publish project tree changes: %s", str(future.exception()))
+
+    def list(self, rel):
+        """
+        Returns the sorted subdirectories of a directory, None if unknown.
+        """
+        self.start()
+        with self.lock:
+            entry = self.entries.get(tuple(rel))
+            return sorted(entry["dirs"]) if entry else None
+
+    def etag(self, rel=None):
+        """
+        ETag of a directory's listing, or of the whole tree without ``rel``.
+        """
+        self.start()
+        with self.lock:
+            if rel is None:
+                return '%s-%d' % (self.epoch, self.version)
+            entry = self.entries.get(tuple(rel))
+            return '%s-%d' % (self.epoch, entry["version"]) if entry else None
+
+    def tree(self, depth=len(LEVELS)):
+        """
+        Returns the first ``depth`` levels as a list of ``{"name": ...}``
+        nodes, each holding the list of its children under the name of the
+        next level, e.g. ``[{"name": "P1", "subjects": [...]}]``. Datafile
+        nodes list their files at full depth.
+        """
+        self.start()
+        with self.lock:
+            return self._nodes((), depth)
+
+    def _nodes(self, rel, depth):
+        entry = self.entries.get(rel)
+        if entry is None:
+            return []
+        nodes = []
+        for name in sorted(entry["dirs"]):
+            node = {"name": name}
+            child = rel + (name,)
+            if len(child) < depth:
+                node[LEVELS[len(child)]] = self._nodes(child, depth)
+            elif len(child) == len(LEVELS) == depth and child in self.entries:
+                files = self.entries[child]["files"]
+                node["files"] = [dict(name=file_name, **files[file_name]) for file_name in sorted(files)]
+            nodes.append(node)
+        return nodes
+
+
+# Index of the projects directory shared by the views and consumers of this process
+project_index = ProjectIndex(settings.PROJECTS_DIRECTORY, settings.PROJECT_INDEX_RECONCILE_SECONDS)
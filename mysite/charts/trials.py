@@ -0,0 +1,163 @@
+import collections
+import os
+import threading
+import logging
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+from .downsample import minmax_downsample, time_window
+from .storage import is_storage_file, read_storage, read_storage_header
+
+logger = logging.getLogger(__name__)
+
+# Columns returned when a request does not ask for specific ones
+DEFAULT_COLUMNS = [
+    'pelvis_tx', 'pelvis_ty', 'pelvis_tz',
+    'knee_angle_r', 'knee_angle_l',
+    'ankle_angle_r', 'ankle_angle_l'
+]
+
+
+# Bytes a memory-mapped column is charged in the trial cache. Its data lives in
+# the page cache, but each map holds a mapping of the process, whose number is
+# bounded by vm.max_map_count, so cached sidecars must still be evicted
+MMAP_COLUMN_COST = 64 * 1024
+
+
+class MissingColumns(Exception):
+    """
+    Raised when a trial file lacks some of the requested columns.
+    """
+
+
+def read_column_names(file_path):
+    """
+    Returns the column names of a trial file.
+    """
+    if is_storage_file(file_path):
+        return read_storage_header(file_path)["labels"]
+    return list(pd.read_csv(file_path, sep='\t', skiprows=4, nrows=0).columns)
+
+
+def parse_trial(file_path, columns):
+    """
+    Parses the given columns of a trial file into NumPy arrays.
+
+    Only the requested columns are kept, as TRIAL_DTYPE except for the
+    float64 time column, so memory scales with the columns actually asked
+    for. OpenSim storage files are read by their header, any other file as
+    tab-separated values with pandas.
+    """
+    # Read the column names first to report missing columns
+    storage_header = read_storage_header(file_path) if is_storage_file(file_path) else None
+    header = storage_header["labels"] if storage_header else read_column_names(file_path)
+    missing = [col for col in columns if col not in header]
+    if missing:
+        raise MissingColumns('Some columns are missing in the file: %s' % ', '.join(missing))
+
+    dtypes = {col: np.float64 if col == 'time' else settings.TRIAL_DTYPE for col in columns}
+    if storage_header:
+        trial = read_storage(file_path, columns, dtypes, storage_header)
+        logger.info("Parsed %d rows of %d columns from %s", len(trial[columns[0]]) if columns else 0, len(columns), file_path)
+        return trial
+
+    # Read the file content as a tab-separated values (TSV) file
+    data = pd.read_csv(file_path, sep='\t', skiprows=4, usecols=columns, dtype=dtypes, engine='c')
+
+    # Log the first few lines of the result for debugging
+    logger.info("First few lines of the result:\n%s", data.head().to_string())
+
+    # Copy the columns so the cache does not keep the whole parsed table alive
+    return {col: data[col].to_numpy(copy=True) for col in columns}
+
+
+def query_trial(trial, columns, start=None, end=None, max_points=None):
+    """
+    Selects the requested columns of a parsed trial, limited to the time
+    window [start, end] and reduced to at most ``max_points`` points.
+
+    The time column is included whenever a window or a point budget is
+    given, since the returned samples are then no longer the whole trial.
+    """
+    if start is None and end is None and max_points is None:
+        return {col: trial[col] for col in columns}
+
+    window = time_window(trial['time'], start, end)
+    times = trial['time'][window]
+    selected = {col: trial[col][window] for col in columns if col != 'time'}
+    if max_points is not None:
+        times, selected = minmax_downsample(times, selected, max_points)
+    return dict({'time': times}, **selected)
+
+
+class TrialCache:
+    """
+    Memory-bounded LRU cache of parsed trials.
+
+    A trial is a dict of column name to NumPy array. Entries are keyed by the
+    file's path, modification time and size, so a file that changes on disk
+    is parsed again and its stale entries are dropped. The least recently
+    used entries are evicted once the arrays exceed ``max_bytes``.
+    Memory-mapped columns live in the page cache and are only charged
+    MMAP_COLUMN_COST each, which is why sidecars are cached once per file
+    rather than per column set.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, path, loader, variant=()):
+        """
+        Returns the cached trial of a file, calling ``loader`` to parse it on a
+        miss. ``variant`` distinguishes different parses of the same file.
+        """
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size) + tuple(variant)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+            self.misses += 1
+
+        trial = loader()
+        size = sum(MMAP_COLUMN_COST if isinstance(column, np.memmap) else column.nbytes for column in trial.values())
+
+        with self.lock:
+            # Drop entries parsed from an older version of the file
+            for stale in [k for k in self.entries if k[0] == path and k[1:3] != key[1:3]]:
+                self.remove(stale)
+            if size <= self.max_bytes and key not in self.entries:
+                self.entries[key] = (trial, size)
+                self.nbytes += size
+                while self.nbytes > self.max_bytes:
+                    self.remove(next(iter(self.entries)))
+                    self.evictions += 1
+        return trial
+
+    def remove(self, key):
+        _, size = self.entries.pop(key)
+        self.nbytes -= size
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.nbytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+# Parsed trials shared by all requests of this process
+trial_cache = TrialCache(settings.TRIAL_CACHE_MAX_BYTES)
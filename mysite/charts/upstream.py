@@ -0,0 +1,161 @@
+import json
+import asyncio
+import os
+import re
+import websockets
+import logging
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from .conversion import UnitConverter
+from .ringbuffer import FrameRing
+from .rosbridge import decode_message, subscribe_message, to_builtin
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait before reconnecting a dropped rosbridge connection
+RECONNECT_DELAY = 2.0
+
+# Shared subscriptions of this process, keyed by topic
+_subscriptions = {}
+
+
+def group_name(topic):
+    """
+    Channel layer group that receives the frames of a topic.
+
+    Group names only allow ASCII alphanumerics, hyphens, underscores and
+    periods, so slashes in the topic are mapped to periods. The process id is
+    part of the name because every process runs its own upstream reader and
+    must only fan out to its own consumers.
+    """
+    return "ros.%d%s" % (os.getpid(), re.sub(r'[^0-9A-Za-z_\-]', '.', topic))
+
+
+class UpstreamSubscription:
+    """
+    A single rosbridge subscription shared by all consumers of a topic.
+
+    The reader task passes every message received from rosbridge through
+    ``process`` once and forwards the result to the topic group as a
+    ``ros.message`` event, numbered by a sequence counter. Compression, throttling and queue length of the
+    subscription come from the ROSBRIDGE_TOPIC_OPTIONS setting.
+    """
+
+    def __init__(self, topic, url):
+        self.topic = topic
+        self.url = url
+        self.group = group_name(topic)
+        self.refcount = 0
+        self.task = None
+        self.seq = 0
+        # Recorders writing the frames of this topic to disk
+        self.recorders = set()
+        self.options = settings.ROSBRIDGE_TOPIC_OPTIONS.get(topic, {})
+        self.subscribe_op = subscribe_message(topic, self.options)
+        self.compressed = self.subscribe_op.get("compression", "none") != "none"
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+
+    async def run(self):
+        channel_layer = get_channel_layer()
+        while True:
+            try:
+                async with websockets.connect(self.url) as ros_bridge:
+                    logger.info("Subscribing to %s on rosbridge", self.topic)
+                    await ros_bridge.send(json.dumps(self.subscribe_op))
+                    async for message in ros_bridge:
+                        logger.debug("Received message from ROS: %s", message)
+                        await self.publish(channel_layer, decode_message(message))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Upstream subscription to %s failed: %s", self.topic, str(e))
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    def process(self, data):
+        return data
+
+    async def publish(self, channel_layer, data):
+        self.seq += 1
+        data = self.process(data)
+        if self.compressed:
+            # CBOR messages may hold NumPy arrays and raw bytes
+            data = to_builtin(data)
+        for recorder in self.recorders:
+            recorder.add(data)
+        await channel_layer.group_send(self.group, {
+            "type": "ros.message",
+            "topic": self.topic,
+            "seq": self.seq,
+            "data": data
+        })
+
+
+class IKSubscription(UpstreamSubscription):
+    """
+    Subscription to the IK output that converts the coordinates of each frame
+    to degrees before fan-out and keeps the recent frames for backfill.
+    """
+
+    def __init__(self, topic, url):
+        super().__init__(topic, url)
+        self.converter = UnitConverter(settings.IK_COORDINATE_MAP)
+        self.ring = FrameRing(settings.IK_BACKFILL_MAX_FRAMES)
+
+    def columns(self, width):
+        return self.converter.column_names(width)
+
+    def process(self, data):
+        msg = data.get('msg')
+        if msg and 'data' in msg:
+            values = self.converter(msg['data'])
+            self.ring.append(msg.get('time'), values)
+            msg['data'] = values.tolist()
+        return data
+
+    def backfill(self):
+        """
+        Returns the timestamps and frames of the last IK_BACKFILL_SECONDS,
+        together with the sequence number of the newest one. Live frames up to
+        that number are already part of the backfill.
+        """
+        times, values = self.ring.snapshot(settings.IK_BACKFILL_SECONDS)
+        return times, values, self.seq
+
+
+# Topics whose frames need processing before fan-out
+subscription_classes = {
+    "/ik/output": IKSubscription,
+}
+
+
+def acquire(topic, url=None):
+    """
+    Returns the shared subscription of a topic, starting it for the first consumer.
+    """
+    subscription = _subscriptions.get(topic)
+    if subscription is None:
+        subscription_class = subscription_classes.get(topic, UpstreamSubscription)
+        subscription = subscription_class(topic, url or settings.ROSBRIDGE_WS_URL)
+        _subscriptions[topic] = subscription
+        subscription.start()
+    subscription.refcount += 1
+    return subscription
+
+
+def release(subscription):
+    """
+    Drops a consumer reference, stopping the subscription when it was the last one.
+    """
+    subscription.refcount -= 1
+    if subscription.refcount <= 0:
+        if _subscriptions.get(subscription.topic) is subscription:
+            del _subscriptions[subscription.topic]
+        subscription.stop()
@@ -0,0 +1,125 @@
+import asyncio
+import multiprocessing
+import threading
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import resource_tracker, shared_memory
+
+import django
+import numpy as np
+from django.conf import settings
+
+from .sidecar import load_trial
+from .trials import query_trial
+
+logger = logging.getLogger(__name__)
+
+# Offset alignment of the arrays in a shared memory block
+ALIGNMENT = 64
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _init_worker():
+    django.setup()
+
+
+def get_pool():
+    """
+    Returns the process pool trials are parsed in, starting it on first use.
+
+    Workers are spawned rather than forked, as the server process runs an
+    event loop and several threads.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.TRIAL_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+            )
+            logger.info("Started %d trial workers", settings.TRIAL_WORKERS)
+    return _pool
+
+
+def reset_pool(pool):
+    """
+    Drops a pool whose worker died, so the next query starts a new one.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+    logger.warning("Restarting the trial workers after a worker died")
+
+
+def _export(arrays):
+    """
+    Copies arrays into a new shared memory block and returns its name and the
+    layout of the arrays in it. The block is unlinked by the reader.
+    """
+    layout = []
+    offset = 0
+    for name, values in arrays.items():
+        layout.append((name, values.dtype.str, len(values), offset))
+        offset += -(-values.nbytes // ALIGNMENT) * ALIGNMENT
+
+    block = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    for (name, dtype, rows, start), values in zip(layout, arrays.values()):
+        np.ndarray((rows,), dtype=dtype, buffer=block.buf, offset=start)[:] = values
+    # The block outlives this worker's handle, the reader unlinks it
+    resource_tracker.unregister(block._name, 'shared_memory')
+    block.close()
+    return block.name, layout
+
+
+def _import(name, layout):
+    """
+    Copies the arrays out of a shared memory block and unlinks it.
+    """
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        return {
+            col: np.ndarray((rows,), dtype=dtype, buffer=block.buf, offset=start).copy()
+            for col, dtype, rows, start in layout
+        }
+    finally:
+        block.close()
+        block.unlink()
+
+
+def _discard(future):
+    # Unlink the result of a query whose request went away
+    if not future.cancelled() and future.exception() is None:
+        name, _ = future.result()
+        block = shared_memory.SharedMemory(name=name)
+        block.close()
+        block.unlink()
+
+
+def _query(file_path, columns, parsed_columns, start, end, max_points):
+    # Runs in a worker, which keeps its own cache of parsed trials
+    trial = load_trial(file_path, parsed_columns)
+    return _export(query_trial(trial, columns, start, end, max_points))
+
+
+async def query_trial_async(file_path, columns, parsed_columns, start=None, end=None, max_points=None):
+    """
+    Loads and queries a trial in the worker pool, without holding the GIL of
+    the server process. The selected arrays come back through shared memory.
+    """
+    pool = get_pool()
+    future = pool.submit(_query, file_path, columns, parsed_columns, start, end, max_points)
+    try:
+        name, layout = await asyncio.wrap_future(future)
+    except asyncio.CancelledError:
+        future.add_done_callback(_discard)
+        raise
+    except BrokenProcessPool:
+        reset_pool(pool)
+        raise
+    return _import(name, layout)
@@ -16,23 +16,33 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
-from charts.views import publish_topic, get_filenames, get_file_data, test_redis_connection, test_ros_bridge_publish, set_name_and_path, list_projects, create_project, list_subjects, create_subject, list_sessions, create_session, list_datafiles, create_datafile
+from charts.views import publish_topic, get_filenames, get_file_data, get_file_data_async, get_files_data, test_redis_connection, test_ros_bridge_publish, set_name_and_path, list_projects, get_tree, create_project, list_subjects, create_subject, list_sessions, create_session, list_datafiles, create_datafile, bulk_create, get_stats, query_trials, query_subjects, start_recording, stop_recording, list_recordings
 
 urlpatterns = [
     path('test-redis/', test_redis_connection),
     path('test-ros-bridge/', test_ros_bridge_publish),
     path('get_filenames/', get_filenames, name='get_filenames'),
     path('get_file_data/<str:filename>/', get_file_data, name='get_file_data'), 
+    path('async/get_file_data/<str:filename>/', get_file_data_async, name='get_file_data_async'),
+    path('get_files_data/', get_files_data, name='get_files_data'),
+    path('api/stats/', get_stats, name='get_stats'),
     # path('admin/', admin.site.urls),
     path('publish/', publish_topic, name='publish_topic'),
     path('set_name_and_path/', set_name_and_path, name='set_name_and_path'),
     # path('subscribe_behavior_logs/', subscribe_behavior_logs, name='subscribe_behavior_logs')
     path('api/projects/', list_projects, name='list_projects'),
     path('api/projects/create/', create_project, name='create_project'),
+    path('api/tree/', get_tree, name='get_tree'),
     path('api/projects/<str:project_name>/subjects/', list_subjects, name='list_subjects'),
     path('api/projects/<str:project_name>/subjects/create/', create_subject, name='create_subject'),
     path('api/projects/<str:project_name>/subjects/<str:subject_id>/sessions/', list_sessions, name='list_sessions'),
     path('api/projects/<str:project_name>/subjects/<str:subject_id>/sessions/create/', create_session, name='create_session'),
     path('api/projects/<str:project_name>/subjects/<str:subject_id>/sessions/<str:session_name>/datafiles/', list_datafiles, name='list_datafiles'),
     path('api/projects/<str:project_name>/subjects/<str:subject_id>/sessions/<str:session_name>/datafiles/create/', create_datafile, name='create_datafile'),
+    path('api/projects/<str:project_name>/bulk/', bulk_create, name='bulk_create'),
+    path('api/catalog/trials/', query_trials, name='query_trials'),
+    path('api/catalog/subjects/', query_subjects, name='query_subjects'),
+    path('api/recordings/', list_recordings, name='list_recordings'),
+    path('api/recordings/start/', start_recording, name='start_recording'),
+    path('api/recordings/stop/', stop_recording, name='stop_recording'),
 ]